@@ -0,0 +1,238 @@
+# ann_index.py (Approximate Nearest-Neighbour Index for Mission-to-Grant Matching)
+
+import os
+import json
+import numpy as np
+
+from embedding_store import load_embedding_store, EMBEDDING_STORE_PATH
+
+# hnswlib is optional; without it the IVF backend (pure numpy) is used.
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# --- CONFIGURATION ---
+ANN_BACKEND = os.environ.get("ANN_BACKEND", "auto") # 'auto', 'hnsw', 'ivf' or 'exact'
+ANN_EXACT_THRESHOLD = int(os.environ.get("ANN_EXACT_THRESHOLD", 50000)) # below this, a brute-force scan is fast enough
+# Recall/latency knobs: higher values search more of the index (better recall, slower queries)
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 128))
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", 16))
+# Build-time parameters
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+IVF_TRAINING_SAMPLE = 100000
+IVF_KMEANS_ITERATIONS = 20
+SCAN_BLOCK_ROWS = 65536 # float16 rows upcast to float32 at a time during a scan
+
+def _normalized(matrix):
+    """
+    Returns unit-length rows. Stores are normalized when written, so their float32 or float16
+    memmap is returned as is and stays shared between processes; anything else (e.g. a store
+    written before that) becomes a normalized float32 copy.
+    """
+    matrix = np.asarray(matrix)
+    norms = np.linalg.norm(matrix[:1000].astype(np.float32), axis=1)
+    tolerance = 1e-3 if matrix.dtype == np.float32 else 1e-2 # float16 keeps ~3 significant digits
+    if matrix.dtype in (np.float32, np.float16) and np.allclose(norms, 1.0, atol=tolerance):
+        return matrix
+    matrix = matrix.astype(np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    return matrix
+
+def _scores(matrix, query):
+    """matrix @ query in float32; float16 rows are upcast a block at a time, never the whole matrix."""
+    if matrix.dtype == np.float32:
+        return matrix @ query
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), SCAN_BLOCK_ROWS):
+        scores[start:start + SCAN_BLOCK_ROWS] = matrix[start:start + SCAN_BLOCK_ROWS].astype(np.float32) @ query
+    return scores
+
+def _top_k(scores, k):
+    """Indices of the k largest scores, best first."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+def _index_paths(store_path):
+    base = os.path.splitext(store_path)[0]
+    return {'meta': f"{base}.ann.json", 'ivf': f"{base}.ivf.npz", 'hnsw': f"{base}.hnsw"}
+
+class ExactIndex:
+    """Brute-force cosine scan. Exact results; latency grows linearly with the corpus."""
+    backend = 'exact'
+
+    def __init__(self, embeddings):
+        self.embeddings = _normalized(embeddings)
+
+    def search(self, query, k):
+        scores = _scores(self.embeddings, query)
+        top = _top_k(scores, k)
+        return scores[top], top
+
+class IVFIndex:
+    """
+    Inverted-file index: vectors are bucketed by their nearest k-means centroid and a
+    query only scans the `nprobe` closest buckets. Stored as CSR-style arrays.
+    """
+    backend = 'ivf'
+
+    def __init__(self, embeddings, centroids, list_offsets, list_members, nprobe=IVF_NPROBE):
+        self.embeddings = _normalized(embeddings)
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_members = list_members
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, embeddings, nlist=None, seed=0):
+        vectors = _normalized(embeddings)
+        count = len(vectors)
+        nlist = nlist or max(1, min(count, int(4 * np.sqrt(count))))
+        rng = np.random.default_rng(seed)
+
+        # Spherical k-means on a sample is enough to place the centroids.
+        sample = vectors[rng.choice(count, size=min(count, IVF_TRAINING_SAMPLE), replace=False)].astype(np.float32)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(IVF_KMEANS_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            filled = np.bincount(assignment, minlength=nlist) > 0
+            centroids[filled] = sums[filled] / np.linalg.norm(sums[filled], axis=1, keepdims=True)
+
+        assignment = np.empty(count, dtype=np.int64)
+        for start in range(0, count, 65536):
+            assignment[start:start + 65536] = np.argmax(vectors[start:start + 65536].astype(np.float32) @ centroids.T, axis=1)
+        list_members = np.argsort(assignment, kind='stable')
+        list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=nlist))))
+        return cls(vectors, centroids, list_offsets, list_members)
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, list_offsets=self.list_offsets, list_members=self.list_members)
+
+    @classmethod
+    def load(cls, path, embeddings):
+        data = np.load(path)
+        return cls(embeddings, data['centroids'], data['list_offsets'], data['list_members'])
+
+    def search(self, query, k):
+        probes = _top_k(self.centroids @ query, self.nprobe)
+        candidates = np.concatenate([self.list_members[self.list_offsets[p]:self.list_offsets[p + 1]] for p in probes])
+        scores = _scores(self.embeddings[candidates], query)
+        top = _top_k(scores, k)
+        return scores[top], candidates[top]
+
+class HNSWIndex:
+    """Hierarchical navigable small-world graph (hnswlib). Near-constant query latency."""
+    backend = 'hnsw'
+
+    def __init__(self, index, ef_search=HNSW_EF_SEARCH):
+        self.index = index
+        self.index.set_ef(ef_search)
+
+    @classmethod
+    def build(cls, embeddings):
+        vectors = _normalized(embeddings)
+        index = hnswlib.Index(space='ip', dim=vectors.shape[1])
+        index.init_index(max_elements=len(vectors), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        index.add_items(vectors, np.arange(len(vectors)))
+        return cls(index)
+
+    def save(self, path):
+        self.index.save_index(path)
+
+    @classmethod
+    def load(cls, path, dim):
+        index = hnswlib.Index(space='ip', dim=dim)
+        index.load_index(path)
+        return cls(index)
+
+    def search(self, query, k):
+        k = min(k, self.index.get_current_count())
+        if k == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        # ef must be at least k for hnswlib to return k results
+        self.index.set_ef(max(HNSW_EF_SEARCH, k))
+        labels, distances = self.index.knn_query(query, k=k)
+        return 1.0 - distances[0], labels[0].astype(np.int64)
+
+class MatchIndex:
+    """Maps search results from matrix positions back to grant ids."""
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.grant_ids = store.grant_ids
+        self.backend = index.backend
+        self.version = store.version
+
+    def __len__(self):
+        return len(self.store)
+
+    def search(self, query_embedding, k=100):
+        """Returns [(grant_id, cosine_similarity), ...] for the k best grants, best first."""
+        query = np.array(query_embedding, dtype=np.float32).ravel()
+        query /= max(np.linalg.norm(query), 1e-12)
+        scores, positions = self.index.search(query, k)
+        return [(int(self.grant_ids[p]), float(s)) for s, p in zip(scores, positions)]
+
+def _choose_backend(count, backend=ANN_BACKEND):
+    if backend == 'auto':
+        if count < ANN_EXACT_THRESHOLD:
+            return 'exact'
+        return 'hnsw' if hnswlib is not None else 'ivf'
+    if backend == 'hnsw' and hnswlib is None:
+        raise ImportError("ANN_BACKEND=hnsw requires the 'hnswlib' package.")
+    return backend
+
+def build_ann_index(store, backend=ANN_BACKEND):
+    """Builds the configured index for an embedding store and saves it next to the store."""
+    backend = _choose_backend(len(store), backend)
+    paths = _index_paths(store.path)
+    if backend == 'ivf':
+        IVFIndex.build(store.embeddings).save(paths['ivf'])
+    elif backend == 'hnsw':
+        HNSWIndex.build(store.embeddings).save(paths['hnsw'])
+
+    # The metadata is written last, so a half-built index is never picked up.
+    with open(paths['meta'], 'w') as f:
+        json.dump({'backend': backend, 'store_version': store.version, 'count': len(store)}, f)
+    return backend
+
+def load_ann_index(store):
+    """
+    Loads the index built for this exact store. Falls back to an exact scan when no index
+    has been built, or when the index on disk was built from a different store version.
+    """
+    paths = _index_paths(store.path)
+    try:
+        with open(paths['meta']) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        meta = None
+
+    if meta is None or meta['store_version'] != store.version:
+        if meta is not None:
+            print("WARNING: ANN index is stale for this embedding store; using an exact scan.")
+        return MatchIndex(store, ExactIndex(store.embeddings))
+    if meta['backend'] == 'ivf':
+        return MatchIndex(store, IVFIndex.load(paths['ivf'], store.embeddings))
+    if meta['backend'] == 'hnsw':
+        if hnswlib is None:
+            print("WARNING: hnswlib is not installed; using an exact scan.")
+            return MatchIndex(store, ExactIndex(store.embeddings))
+        return MatchIndex(store, HNSWIndex.load(paths['hnsw'], store.header['dim']))
+    return MatchIndex(store, ExactIndex(store.embeddings))
+
+def main():
+    print("--- Building ANN Index for Grant Embeddings ---")
+    store = load_embedding_store(EMBEDDING_STORE_PATH)
+    print(f"Loaded {len(store)} embeddings from '{EMBEDDING_STORE_PATH}'.")
+    backend = build_ann_index(store)
+    print(f"--- Success! Built a '{backend}' index. ---")
+
+if __name__ == "__main__":
+    main()
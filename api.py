@@ -7,6 +7,9 @@ load_dotenv()
 # Standard library imports
 import os
 import json
+import time
+import threading
+from functools import wraps
 from datetime import datetime, timedelta
 
 # Flask and extensions
@@ -21,31 +24,158 @@ import stripe
 import google.generativeai as genai
 import psycopg2 
 from psycopg2.extras import RealDictCursor
-import torch
-from sentence_transformers import SentenceTransformer, util
+
+# Local modules
+from embedding_store import load_embedding_store, EMBEDDING_STORE_PATH
+from embedding_encoder import load_model, encoder_cache_name, ENCODER_BACKEND
+from db_pool import PooledConnections
+from ann_index import load_ann_index
+from match_cache import get_match_cache, mission_cache_key
+from foundation_ranking import rank_foundations, CANDIDATE_GRANTS
 
 # --- FLASK APP SETUP ---
 app = Flask(__name__, static_folder='static', template_folder='templates')
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "a-strong-default-secret-key")
 CORS(app, supports_credentials=True)
 
+# --- CONFIGURATION ---
+MATCH_MODEL_NAME = 'all-MiniLM-L6-v2'
+MATCH_ENCODER_BACKEND = ENCODER_BACKEND # queries must be encoded by the backend that encoded the store
+WARM_UP_ON_IMPORT = os.environ.get("WARM_UP_ON_IMPORT", "1") == "1"
+WARM_UP_IN_BACKGROUND = os.environ.get("WARM_UP_IN_BACKGROUND", "0") == "1"
+WARM_UP_RETRY_SECONDS = float(os.environ.get("WARM_UP_RETRY_SECONDS", 30)) # wait between attempts after a failure
+
 # --- GLOBAL VARIABLES FOR CACHING MODELS ---
-# We will load the models into these variables the first time they are needed.
+# These are filled by warm_up_match_index(); until this process is 'ready', only /api/matches answers 503.
 retriever = None
-grant_ids = None
-grant_embeddings = None
+match_index = None
+match_cache = get_match_cache()
+match_cache_version = None # index version plus retrieval depth; part of every cache key
+warm_up_state = {'status': 'cold', 'error': None, 'started_at': None, 'finished_at': None}
+warm_up_lock = threading.Lock()
+warm_up_thread = None
+warm_up_start_lock = threading.Lock()
+warm_up_retry_at = 0.0 # monotonic time before which a failed warm-up is not retried
+
+# --- MODEL & INDEX WARM-UP ---
+def warm_up_match_index(first_query=True):
+    """
+    Loads the SentenceTransformer model, the grant embedding store and its ANN index exactly once.
+    Run at import time, so `gunicorn --preload api:app` does it in the master process
+    and every forked worker inherits the loaded model and the shared memory-mapped store.
+
+    With first_query, also runs one query end to end in this process, so lazy torch
+    initialisation doesn't land on the first user. The import-time load skips it: torch
+    starts its thread pools on the first encode, and forking a process whose pools are
+    running can deadlock (the reason EncoderPool spawns its workers). Each worker runs
+    its own first query after the fork instead; see _warm_up_after_fork().
+    """
+    global retriever, match_index, match_cache_version, warm_up_retry_at
+
+    with warm_up_lock:
+        if warm_up_state['status'] == 'ready':
+            return True
+        warm_up_state.update(status='warming', error=None, started_at=datetime.utcnow().isoformat())
+        try:
+            if match_index is None:
+                print("Warming up: loading AI model and grant embeddings...")
+                model = load_model(MATCH_MODEL_NAME, MATCH_ENCODER_BACKEND)
+                # The store is memory-mapped, so gunicorn workers share the same page-cache pages.
+                store = load_embedding_store(EMBEDDING_STORE_PATH, expected_model=MATCH_MODEL_NAME,
+                                             expected_encoder=encoder_cache_name(MATCH_MODEL_NAME, MATCH_ENCODER_BACKEND))
+                index = load_ann_index(store)
+                retriever, match_index = model, index
+                match_cache_version = f"{index.version}:{CANDIDATE_GRANTS}"
+                # Results ranked against a previously published index can never be served again.
+                match_cache.purge_stale(match_cache_version)
+                print(f"Loaded {len(store)} grant embeddings, '{index.backend}' index.")
+            if not first_query:
+                warm_up_state.update(status='loaded', finished_at=datetime.utcnow().isoformat())
+                return True
+            match_index.search(retriever.encode("warm-up"), k=1)
+            warm_up_state.update(status='ready', finished_at=datetime.utcnow().isoformat())
+            print(f"Warm-up complete in process {os.getpid()}.")
+            return True
+        except FileNotFoundError:
+            message = f"{EMBEDDING_STORE_PATH} not found. Please run the data pipeline."
+        except Exception as e:
+            message = str(e)
+        warm_up_state.update(status='failed', error=message, finished_at=datetime.utcnow().isoformat())
+        warm_up_retry_at = time.monotonic() + WARM_UP_RETRY_SECONDS
+        print(f"WARNING: Warm-up failed: {message} (retrying in {WARM_UP_RETRY_SECONDS:g}s at the earliest)")
+        return False
+
+def start_warm_up_if_needed(first_query=True):
+    """
+    Starts a background warm-up when this process isn't ready and none is running: the first
+    time when WARM_UP_ON_IMPORT=0, to run the first query after an import-time load, or again
+    once WARM_UP_RETRY_SECONDS have passed since a failure. Returns immediately; callers keep
+    answering 503 until it's ready.
+    """
+    global warm_up_thread
+    if warm_up_state['status'] == 'ready':
+        return
+    with warm_up_start_lock: # concurrent requests start one thread between them
+        if warm_up_thread is not None and warm_up_thread.is_alive():
+            return
+        if warm_up_state['status'] == 'failed' and time.monotonic() < warm_up_retry_at:
+            return
+        warm_up_thread = threading.Thread(target=warm_up_match_index, kwargs={'first_query': first_query},
+                                          name="warm-up", daemon=True)
+        warm_up_thread.start()
+
+def _warm_up_after_fork():
+    """
+    Runs in each forked worker: fresh locks (a parent thread may have held one at the fork),
+    then the worker's own first query, in the background, as soon as it starts.
+    """
+    global warm_up_lock, warm_up_start_lock, warm_up_thread
+    warm_up_lock, warm_up_start_lock, warm_up_thread = threading.Lock(), threading.Lock(), None
+    if warm_up_state['status'] == 'loaded':
+        start_warm_up_if_needed()
+
+os.register_at_fork(after_in_child=_warm_up_after_fork)
+
+def requires_match_index(view):
+    """Answers 503 from views that need the model and index until they are loaded."""
+    @wraps(view)
+    def guarded(*args, **kwargs):
+        if warm_up_state['status'] != 'ready':
+            start_warm_up_if_needed()
+            response = jsonify(error="Matching is starting up. Please try again shortly.", status=warm_up_state['status'])
+            response.status_code = 503
+            response.headers['Retry-After'] = '5'
+            return response
+        return view(*args, **kwargs)
+    return guarded
+
+@app.route('/healthz')
+def health_check():
+    """Readiness probe for the load balancer: 200 once warm, 503 before that (and retries a failed warm-up)."""
+    start_warm_up_if_needed()
+    status_code = 200 if warm_up_state['status'] == 'ready' else 503
+    return jsonify(warm_up_state), status_code
 
 # --- DATABASE SETUP ---
+# One pool per worker process; requests borrow a connection instead of reconnecting.
+db_pool = PooledConnections(os.environ.get("DATABASE_URL"), cursor_factory=RealDictCursor)
+
 def get_db():
     if 'db' not in g:
-        g.db = psycopg2.connect(os.environ.get("DATABASE_URL"), cursor_factory=RealDictCursor)
+        g.db = db_pool.getconn()
     return g.db
 
 @app.teardown_appcontext
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        # A request that failed mid-query may leave the connection unusable, so don't reuse it.
+        db_pool.putconn(db, close=e is not None)
+
+@app.route('/healthz/db')
+def db_pool_stats():
+    """Connection pool counters for this worker process."""
+    return jsonify(db_pool.stats())
 
 # --- FLASK-LOGIN SETUP ---
 login_manager = LoginManager()
@@ -68,6 +198,36 @@ def load_user(user_id):
         return User(user_data)
     return None
 
+# --- RANKED GRANT HYDRATION ---
+def hydrate_ranked_grants(cursor, ranked_hits):
+    """
+    Fetches the grant and foundation rows for a ranked list of (grant_id, score) hits
+    with one set-based query, keeping the ranking order. Hits whose grant no longer
+    exists in the database are dropped.
+    """
+    if not ranked_hits:
+        return []
+
+    # WITH ORDINALITY carries each id's rank through the join, so Postgres returns
+    # the rows already in ranking order.
+    cursor.execute("""
+        SELECT r.rank, g.grant_purpose, g.grant_amount, f.name as foundation_name, f.ein as foundation_ein
+        FROM unnest(%s::int[]) WITH ORDINALITY AS r(grant_id, rank)
+        JOIN grants g ON g.id = r.grant_id
+        JOIN foundations f ON g.foundation_ein = f.ein
+        ORDER BY r.rank
+    """, ([int(grant_id) for grant_id, _ in ranked_hits],))
+
+    matches = []
+    for row in cursor.fetchall():
+        match_data = dict(row)
+        rank = match_data.pop('rank')
+        matches.append({
+            "score": ranked_hits[rank - 1][1],
+            "grant": match_data
+        })
+    return matches
+
 # --- WEBSITE ROUTES ---
 # ... (Your existing routes: /dashboard, /login, /signup, /crm, etc.) ...
 @app.route('/')
@@ -97,24 +257,11 @@ def crm():
 # --- CORRECTED: AI MATCHING ENDPOINT ---
 @app.route('/api/matches')
 @login_required
+@requires_match_index
 def get_matches():
-    global retriever, grant_ids, grant_embeddings
-
-    # 1. Load models and data ONLY if they haven't been loaded yet
-    if retriever is None:
-        print("Loading AI models for the first time...")
-        retriever = SentenceTransformer('all-MiniLM-L6-v2')
-        try:
-            with open('grant_embeddings.json', 'r') as f:
-                embedding_data = json.load(f)
-                grant_ids = embedding_data['grant_ids']
-                grant_embeddings = torch.tensor(embedding_data['embeddings'])
-            print("AI models and embeddings loaded successfully.")
-        except FileNotFoundError:
-            print("WARNING: grant_embeddings.json not found.")
-            return jsonify(error="The grant embeddings file has not been generated yet. Please run the data pipeline."), 500
+    # The model and index were loaded by the startup warm-up (see warm_up_match_index).
 
-    # 2. Get the user's profile to find their mission
+    # 1. Get the user's profile to find their mission
     db = get_db()
     cursor = db.cursor()
     cursor.execute("SELECT mission_statement FROM users WHERE id = %s", (current_user.id,))
@@ -123,28 +270,22 @@ def get_matches():
     if not user_profile or not user_profile.get('mission_statement'):
         return jsonify(error="Your profile is incomplete. Please add your mission statement in the settings."), 400
 
-    # 3. Perform the AI search
-    query_embedding = retriever.encode(user_profile['mission_statement'], convert_to_tensor=True)
-    cos_scores = util.cos_sim(query_embedding, grant_embeddings)[0]
-    top_results = torch.topk(cos_scores, k=100) # Find top 100 grants
+    # 2. Perform the AI search against the ANN index, unless this mission was already
+    #    ranked against the current index. Editing the mission changes the cache key.
+    cache_key = mission_cache_key(user_profile['mission_statement'], match_cache_version)
+    ranked_hits = match_cache.get(cache_key)
+    if ranked_hits is None:
+        query_embedding = retriever.encode(user_profile['mission_statement'])
+        ranked_hits = match_index.search(query_embedding, k=CANDIDATE_GRANTS)
+        match_cache.set(cache_key, ranked_hits, match_cache_version)
+
+    # 3. Return individual grants on request; otherwise roll the hits up to foundations
+    if request.args.get('view') == 'grants':
+        matches = hydrate_ranked_grants(cursor, ranked_hits[:100])
+    else:
+        limit = min(request.args.get('limit', 25, type=int), 100)
+        matches = rank_foundations(cursor, ranked_hits, current_user.id, limit=limit)
 
-    # 4. Process and return the results
-    matches = []
-    for score, idx in zip(top_results[0], top_results[1]):
-        grant_id = grant_ids[idx]
-        cursor.execute("""
-            SELECT g.grant_purpose, g.grant_amount, f.name as foundation_name, f.ein as foundation_ein
-            FROM grants g
-            JOIN foundations f ON g.foundation_ein = f.ein
-            WHERE g.id = %s
-        """, (grant_id,))
-        match_data = cursor.fetchone()
-        if match_data:
-            matches.append({
-                "score": score.item(),
-                "grant": match_data
-            })
-    
     return jsonify(matches)
 
 
@@ -196,7 +337,20 @@ def handle_logout():
     logout_user()
     return jsonify(message="Logout successful!"), 200
 
+# --- STARTUP WARM-UP ---
+# Loads when the module is imported, i.e. before gunicorn forks workers under --preload;
+# the first query then runs in each worker (or, without a fork, on the first match request
+# or readiness probe). WARM_UP_IN_BACKGROUND lets a dev server start listening immediately;
+# only the match endpoint answers 503 until it's ready. Without either, the first match
+# request (or readiness probe) starts the whole warm-up.
+if WARM_UP_ON_IMPORT:
+    if WARM_UP_IN_BACKGROUND:
+        start_warm_up_if_needed(first_query=False)
+    else:
+        warm_up_match_index(first_query=False)
+
 # --- MAIN APP LOGIC ---
 if __name__ == '__main__':
+    warm_up_match_index() # no fork here, so the first query can run right away
     app.run(debug=True, port=5000)
 
@@ -0,0 +1,97 @@
+# benchmark_encoders.py (CPU Encoder Throughput and Drift against the fp32 Baseline)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import sys
+import time
+import numpy as np
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from embedding_encoder import EncoderPool, load_model, ENCODER_BACKENDS
+from embedding_pipeline import encode_length_sorted
+
+# --- CONFIGURATION ---
+MODEL_NAME = 'all-MiniLM-L6-v2'
+SAMPLE_SIZE = 2000 # distinct grant purposes, the same ones on every run
+NEIGHBORS_K = 10 # drift is also measured as overlap of each text's top-k neighbours within the sample
+# The sample is ordered by a hash of the text, so it's fixed for a given table, not "the first N rows"
+SAMPLE_QUERY = """
+    SELECT grant_purpose FROM (SELECT DISTINCT grant_purpose FROM grants WHERE grant_purpose IS NOT NULL) AS purposes
+    ORDER BY md5(grant_purpose)
+    LIMIT %s
+"""
+
+def _unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def _top_neighbors(vectors, k):
+    similarities = vectors @ vectors.T
+    np.fill_diagonal(similarities, -np.inf)
+    return np.argpartition(-similarities, k, axis=1)[:, :k]
+
+def drift(baseline, candidate, k=NEIGHBORS_K):
+    """Cosine similarity of each vector to its fp32 counterpart, and top-k neighbour overlap."""
+    baseline, candidate = _unit(baseline), _unit(candidate)
+    cosine = np.einsum('ij,ij->i', baseline, candidate)
+    k = min(k, len(baseline) - 1)
+    base_neighbors, cand_neighbors = _top_neighbors(baseline, k), _top_neighbors(candidate, k)
+    overlap = np.mean([len(np.intersect1d(b, c)) / k for b, c in zip(base_neighbors, cand_neighbors)])
+    return {'mean_cosine': float(cosine.mean()), 'min_cosine': float(cosine.min()), 'neighbor_overlap': float(overlap)}
+
+def timed_encode(encoder, texts):
+    started = time.perf_counter()
+    vectors = encode_length_sorted(encoder, texts)
+    return vectors, len(texts) / max(time.perf_counter() - started, 1e-9)
+
+def main():
+    backends = [arg for arg in sys.argv[1:] if arg in ENCODER_BACKENDS] or list(ENCODER_BACKENDS)
+    conn = None
+    try:
+        db_url = os.environ.get("DATABASE_URL")
+        if not db_url:
+            raise ValueError("DATABASE_URL not found.")
+        conn = psycopg2.connect(db_url, cursor_factory=RealDictCursor)
+        with conn.cursor() as cursor:
+            cursor.execute(SAMPLE_QUERY, (SAMPLE_SIZE,))
+            texts = [row['grant_purpose'] for row in cursor.fetchall()]
+        if len(texts) < 2:
+            print("Not enough grant purposes to benchmark.")
+            return
+        print(f"--- Benchmarking '{MODEL_NAME}' on {len(texts)} grant purposes ---")
+
+        print("Baseline: fp32, single process...")
+        model = load_model(MODEL_NAME, 'fp32')
+        timed_encode(model, texts[:64]) # warm-up
+        baseline, baseline_rate = timed_encode(model, texts)
+        del model
+        results = [('fp32 x1 process', baseline_rate, drift(baseline, baseline))]
+
+        for backend in backends:
+            try:
+                with EncoderPool(MODEL_NAME, backend=backend) as encoder:
+                    label = f"{backend} x{encoder.processes} processes x{encoder.threads} threads"
+                    print(f"{label}...")
+                    encoder.encode(texts[:encoder.processes * 8], batch_size=8) # loads the model in every worker
+                    vectors, rate = timed_encode(encoder, texts)
+            except Exception as e:
+                print(f"  Skipping '{backend}': {e}")
+                continue
+            results.append((label, rate, drift(baseline, vectors)))
+
+        print(f"\n{'Encoder':<42}{'texts/s':>10}{'speedup':>9}{'mean cos':>10}{'min cos':>9}{f'top-{NEIGHBORS_K}':>8}")
+        for label, rate, stats in results:
+            print(f"{label:<42}{rate:>10,.0f}{rate / baseline_rate:>8.1f}x"
+                  f"{stats['mean_cosine']:>10.5f}{stats['min_cosine']:>9.5f}{stats['neighbor_overlap']:>8.1%}")
+
+    except Exception as e:
+        print(f"\nAn error occurred: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    main()
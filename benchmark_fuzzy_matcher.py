@@ -0,0 +1,84 @@
+# benchmark_fuzzy_matcher.py (Blocked Matcher Recall against Exhaustive extractOne)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import time
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from rapidfuzz import fuzz, process, utils
+from tqdm import tqdm
+
+from name_normalizer import normalize_name
+from charity_index import GROUPINGS, build_charity_index
+from fuzzy_matcher import NameIndex
+
+# --- CONFIGURATION ---
+GROUP_BY = 'prefix' # the blocked_fuzzy pass: the largest groups and the lowest cutoff
+SCORE_CUTOFF = 85
+SAMPLE_SIZE = 2000 # distinct recipient names, the same ones on every run
+# Ordered by a hash of the name, so the sample is fixed for a given table, not "the first N rows"
+SAMPLE_QUERY = """
+    SELECT recipient_name FROM (SELECT DISTINCT recipient_name FROM grants WHERE recipient_name IS NOT NULL) AS names
+    ORDER BY md5(recipient_name)
+    LIMIT %s
+"""
+
+def main():
+    conn = None
+    try:
+        db_url = os.environ.get("DATABASE_URL")
+        if not db_url:
+            raise ValueError("DATABASE_URL not found.")
+        conn = psycopg2.connect(db_url, cursor_factory=RealDictCursor)
+        index = NameIndex.open(build_charity_index(conn, GROUP_BY))
+        with conn.cursor() as cursor:
+            cursor.execute(SAMPLE_QUERY, (SAMPLE_SIZE,))
+            names = [row['recipient_name'] for row in cursor.fetchall()]
+        print(f"--- Comparing the blocked matcher with exhaustive extractOne on {len(names)} recipient names "
+              f"(grouping '{GROUP_BY}', cutoff {SCORE_CUTOFF}) ---")
+
+        counts = {'queries': 0, 'exhaustive': 0, 'blocked': 0, 'same_score': 0, 'missed': 0}
+        seconds = {'exhaustive': 0.0, 'blocked': 0.0}
+        for name in tqdm(names, desc="Matching"):
+            keyed = GROUPINGS[GROUP_BY](None, normalize_name(name), None)
+            matcher = index.matcher(keyed[0]) if keyed else None
+            if not matcher:
+                continue
+            query = utils.default_process(keyed[1])
+            choices = matcher.names()
+
+            started = time.perf_counter()
+            expected = process.extractOne(query, choices, scorer=fuzz.WRatio, processor=None, score_cutoff=SCORE_CUTOFF)
+            seconds['exhaustive'] += time.perf_counter() - started
+            started = time.perf_counter()
+            found = matcher.match(query, score_cutoff=SCORE_CUTOFF)
+            seconds['blocked'] += time.perf_counter() - started
+
+            counts['queries'] += 1
+            counts['exhaustive'] += expected is not None
+            counts['blocked'] += found is not None
+            if expected is not None:
+                if found is not None and found[2] >= expected[1]:
+                    counts['same_score'] += 1
+                elif found is None:
+                    counts['missed'] += 1
+
+        matched = max(counts['exhaustive'], 1)
+        print(f"\nQueries with a block:           {counts['queries']:,}")
+        print(f"Matched by exhaustive search:   {counts['exhaustive']:,}")
+        print(f"Matched by the blocked matcher: {counts['blocked']:,}")
+        print(f"Best score found (recall):      {counts['same_score']:,} ({counts['same_score'] / matched:.1%})")
+        print(f"Missed entirely:                {counts['missed']:,} ({counts['missed'] / matched:.1%})")
+        print(f"Time: exhaustive {seconds['exhaustive']:.1f}s, blocked {seconds['blocked']:.1f}s "
+              f"({seconds['exhaustive'] / max(seconds['blocked'], 1e-9):.0f}x)")
+
+    except Exception as e:
+        print(f"\nAn error occurred: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    main()
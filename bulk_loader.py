@@ -0,0 +1,128 @@
+# bulk_loader.py (COPY-Based Bulk Loading with Staging-Table Merge)
+
+import io
+import time
+import itertools
+from psycopg2 import sql
+
+# --- CONFIGURATION ---
+COPY_READ_CHUNK_ROWS = 5000 # rows formatted at a time while COPY pulls from the stream
+COPY_READ_SIZE = 1 << 20 # bytes COPY asks for per read()
+
+def _format_value(value):
+    """Formats one value for COPY's text format (tab-separated, \\N for NULL)."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, (list, tuple)) or getattr(value, 'ndim', 0) > 0:
+        # Vectors (lists or numpy arrays) use pgvector's text input: [0.1,0.2,...].
+        # tolist() turns a whole array into Python floats in one C call.
+        value = '[' + ','.join(map(repr, value.tolist() if hasattr(value, 'tolist') else map(float, value))) + ']'
+    elif isinstance(value, bool):
+        value = 't' if value else 'f'
+    else:
+        value = str(value)
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                 .replace('\n', '\\n').replace('\r', '\\r'))
+
+class _RowStream(io.TextIOBase):
+    """A read-only file object that formats rows lazily, so COPY streams without buffering the load."""
+    def __init__(self, rows, columns):
+        self._rows = iter(rows)
+        self._columns = columns
+        self._buffer = ''
+        self._pos = 0
+        self.row_count = 0
+
+    def readable(self):
+        return True
+
+    def _row_values(self, row):
+        if isinstance(row, dict):
+            return (row.get(column) for column in self._columns)
+        return row
+
+    def _refill(self):
+        chunk = list(itertools.islice(self._rows, COPY_READ_CHUNK_ROWS))
+        self.row_count += len(chunk)
+        self._buffer = ''.join('\t'.join(_format_value(v) for v in self._row_values(row)) + '\n' for row in chunk)
+        self._pos = 0
+        return bool(chunk)
+
+    def read(self, size=-1):
+        if self._pos >= len(self._buffer) and not self._refill():
+            return ''
+        if size < 0:
+            size = len(self._buffer) - self._pos
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+def _report(label, row_count, started, report):
+    seconds = max(time.perf_counter() - started, 1e-9)
+    stats = {'table': label, 'rows': row_count, 'seconds': seconds, 'rows_per_second': row_count / seconds}
+    if report:
+        print(f"{label}: loaded {row_count:,} rows in {seconds:.2f}s ({stats['rows_per_second']:,.0f} rows/s)")
+    return stats
+
+def copy_into_staging(cursor, table, columns, rows, row_order=False):
+    """
+    Creates a session-private staging table shaped like `table` (temp tables are never
+    WAL-logged, so this is unlogged by construction), streams `rows` into it with
+    COPY FROM STDIN, and returns (staging_name, row_count). The table is dropped at commit.
+    With row_order, a staging_row column numbers the rows in the order they were given.
+    """
+    staging = f"staging_{table}"
+    column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(staging)))
+    cursor.execute(sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(
+        sql.Identifier(staging), column_list, sql.Identifier(table)))
+    if row_order:
+        # COPY fills the serial column in input order
+        cursor.execute(sql.SQL("ALTER TABLE {} ADD COLUMN staging_row BIGSERIAL").format(sql.Identifier(staging)))
+    stream = _RowStream(rows, columns)
+    cursor.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN").format(sql.Identifier(staging), column_list).as_string(cursor),
+                       stream, size=COPY_READ_SIZE)
+    return staging, stream.row_count
+
+def bulk_insert(cursor, table, columns, rows, on_conflict="ON CONFLICT DO NOTHING", report=True):
+    """
+    Loads rows (dicts keyed by column, or tuples in column order) into `table` through
+    COPY and a staging table, then merges with one INSERT ... SELECT that keeps the same
+    ON CONFLICT semantics as the old execute_batch INSERTs. The caller commits.
+    Returns load stats, including rows per second; `report` also prints them.
+    """
+    started = time.perf_counter()
+    staging, row_count = copy_into_staging(cursor, table, columns, rows)
+    column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+    cursor.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} " + on_conflict).format(
+        sql.Identifier(table), column_list, column_list, sql.Identifier(staging)))
+    merged = cursor.rowcount
+    stats = _report(table, row_count, started, report)
+    stats['merged'] = merged
+    return stats
+
+def bulk_update(cursor, table, key_columns, update_columns, rows, report=True):
+    """
+    Applies row-level UPDATEs as one UPDATE ... FROM join against a COPY-loaded staging table.
+    Equivalent to execute_batch("UPDATE table SET ... WHERE key = ...") for every row: when
+    a key appears more than once, the last row given wins.
+    """
+    started = time.perf_counter()
+    staging, row_count = copy_into_staging(cursor, table, key_columns + update_columns, rows, row_order=True)
+    assignments = sql.SQL(', ').join(
+        sql.SQL("{} = s.{}").format(sql.Identifier(c), sql.Identifier(c)) for c in update_columns)
+    join_condition = sql.SQL(' AND ').join(
+        sql.SQL("t.{} = s.{}").format(sql.Identifier(c), sql.Identifier(c)) for c in key_columns)
+    key_list = sql.SQL(', ').join(map(sql.Identifier, key_columns))
+    # UPDATE ... FROM with duplicate keys would apply an arbitrary one of them
+    latest = sql.SQL("SELECT DISTINCT ON ({}) * FROM {} ORDER BY {}, staging_row DESC").format(
+        key_list, sql.Identifier(staging), key_list)
+    cursor.execute(sql.SQL("UPDATE {} t SET {} FROM ({}) s WHERE {}").format(
+        sql.Identifier(table), assignments, latest, join_condition))
+    merged = cursor.rowcount
+    stats = _report(table, row_count, started, report)
+    stats['merged'] = merged
+    return stats
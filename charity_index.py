@@ -0,0 +1,87 @@
+# charity_index.py (Shared, Memory-Mapped Charity Name Indexes for Enrichment Workers)
+
+import os
+from collections import defaultdict
+from tqdm import tqdm
+
+from name_normalizer import normalize_name
+from db_stream import stream_rows
+from fuzzy_matcher import NameIndex
+
+# --- CONFIGURATION ---
+CHARITY_INDEX_DIR = os.environ.get("CHARITY_INDEX_DIR", "charity_index")
+GRANT_CHUNK_SIZE = 2000 # grants sent to a worker per task
+
+# How charities are keyed into index groups: (ein, normalized name, state) -> (group, indexed name),
+# or None to leave the charity out. The same function places a grant in its group.
+GROUPINGS = {
+    'state': lambda ein, normalized, state: (state, normalized) if normalized and state else None, # foundation's state
+    'prefix': lambda ein, normalized, state: (normalized[:4], normalized) if normalized else None, # first 4 letters
+    'name': lambda ein, normalized, state: ('', normalized) if normalized else None, # exact names, all states
+    'ein': lambda ein, normalized, state: ('', ein.strip()) if ein and ein.strip() else None, # exact EINs
+}
+FUZZY_GROUPINGS = {'state', 'prefix'} # the others only serve exact lookups, so they skip the n-gram index
+# Recorded in grants.match_method for matches made by fuzzy matching within each grouping
+FUZZY_MATCH_METHODS = {'state': 'geo_fuzzy', 'prefix': 'blocked_fuzzy'}
+
+def charity_index_path(group_by):
+    return f"{CHARITY_INDEX_DIR}_by_{group_by}"
+
+def build_charity_indexes(conn, groupings=('state',)):
+    """
+    Reads and normalizes the charities table once and writes one read-only NameIndex per
+    grouping for Pool workers to memory-map. Returns {grouping: index path}.
+    """
+    names_by_grouping = {group_by: defaultdict(dict) for group_by in groupings}
+    for ein, name, state in tqdm(stream_rows(conn, "SELECT ein, name, state FROM charities", row_type='tuple'),
+                                 desc="Organizing Charities"):
+        normalized = normalize_name(name)
+        for group_by, names_by_group in names_by_grouping.items():
+            keyed = GROUPINGS[group_by](ein, normalized, state)
+            if keyed:
+                group, indexed_name = keyed
+                names_by_group[group][indexed_name] = ein.strip() if group_by == 'ein' else ein
+
+    paths = {}
+    for group_by, names_by_group in names_by_grouping.items():
+        path = charity_index_path(group_by)
+        index = NameIndex.build(names_by_group, ngrams=group_by in FUZZY_GROUPINGS)
+        index.save(path)
+        print(f"Charity index '{group_by}' built for {len(index.groups)} groups ({len(index):,} names) at {path}.")
+        paths[group_by] = path
+    return paths
+
+def build_charity_index(conn, group_by='state'):
+    """Builds a single grouping's index; returns its path."""
+    return build_charity_indexes(conn, (group_by,))[group_by]
+
+def chunk_grants(grants, size=GRANT_CHUNK_SIZE):
+    """
+    Turns grant rows into compact (id, recipient_name, state, recipient_ein) tuples, ordered
+    by state so each chunk touches few index groups, and splits them into worker-sized chunks.
+    """
+    rows = sorted(((g['id'], g['recipient_name'], g.get('state'), g.get('recipient_ein')) for g in grants),
+                  key=lambda g: (g[2] or '', g[0]))
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+def match_grant_chunk(index, chunk, score_cutoff, group_by='state'):
+    """
+    Fuzzy-matches one chunk of grant tuples within their groups. Returns
+    (grant_id, ein, match_method, match_score) for every grant that matched.
+    """
+    group_key = GROUPINGS[group_by]
+    grants_by_group = defaultdict(list)
+    for grant_id, recipient_name, state, _ in chunk:
+        keyed = group_key(None, normalize_name(recipient_name), state)
+        if keyed:
+            grants_by_group[keyed[0]].append((grant_id, keyed[1]))
+
+    method = FUZZY_MATCH_METHODS[group_by]
+    updates = []
+    for group, grants in grants_by_group.items():
+        matcher = index.matcher(group)
+        if not matcher:
+            continue
+        matches = matcher.match_many([name for _, name in grants], score_cutoff=score_cutoff)
+        updates.extend((grant_id, match[1], method, match[2]) for (grant_id, _), match in zip(grants, matches) if match)
+    return updates
@@ -0,0 +1,191 @@
+# db_pool.py (Process-Wide Pooled Postgres Connections for the Web Tier)
+
+import os
+import time
+import threading
+from collections import deque
+import psycopg2
+from psycopg2 import extensions, pool
+
+# --- CONFIGURATION ---
+DB_POOL_MAX_CONNECTIONS = int(os.environ.get("DB_POOL_MAX_CONNECTIONS", 10))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.environ.get("DB_POOL_CHECKOUT_TIMEOUT", 10)) # seconds to wait for a free connection
+DB_POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", 1800)) # recycle connections older than this
+DB_POOL_PING_AFTER_IDLE = float(os.environ.get("DB_POOL_PING_AFTER_IDLE", 30)) # health-check connections idle longer than this
+
+class PooledConnections:
+    """
+    A thread-safe, fork-aware Postgres connection pool.
+
+    psycopg2's own pools close every returned connection above `minconn`, which puts the
+    TLS handshake back on the request path, so this pool keeps up to `maxconn` idle
+    connections instead. Callers wait (up to a timeout) when the pool is exhausted,
+    connections idle for a while are pinged before reuse, and old ones are recycled.
+    """
+    def __init__(self, dsn, maxconn=DB_POOL_MAX_CONNECTIONS, **connect_kwargs):
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.connect_kwargs = connect_kwargs
+        self._cond = threading.Condition()
+        self._reset(pid=None)
+
+    def _reset(self, pid):
+        self._pid = pid
+        self._idle = deque() # (conn, born_at, last_used_at), most recently used on the right
+        self._born_at = {}
+        self._open = 0
+        self._stats = {'checkouts': 0, 'waits': 0, 'timeouts': 0, 'wait_seconds': 0.0,
+                       'connections_opened': 0, 'recycled': 0, 'health_check_failures': 0}
+
+    def _check_fork(self):
+        # Connections must never cross a fork: a worker that inherits the master's pool
+        # (e.g. under gunicorn --preload) starts an empty one and leaves the inherited sockets alone.
+        if self._pid != os.getpid():
+            self._reset(pid=os.getpid())
+
+    def _usable(self, conn, born_at):
+        """The checks that need no round trip to the server, made under the lock."""
+        if conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - born_at > DB_POOL_MAX_LIFETIME:
+            self._stats['recycled'] += 1
+            return False
+        return True
+
+    @staticmethod
+    def _ping(conn):
+        """A SELECT 1 round trip. Never called under the lock, so a slow connection only stalls its caller."""
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _forget(self, conn):
+        """Drops a connection from the pool's books (under the lock); the caller closes it."""
+        self._born_at.pop(id(conn), None)
+        self._open -= 1
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _take(self, started):
+        """
+        Under the lock: pops an idle connection, returning (conn, needs_ping), or reserves a
+        slot for a new connection, returning (None, False). Waits while the pool is exhausted.
+        """
+        discarded = []
+        try:
+            with self._cond:
+                self._check_fork()
+                waited = False
+                while True:
+                    while self._idle:
+                        conn, born_at, last_used_at = self._idle.pop()
+                        if self._usable(conn, born_at):
+                            return conn, time.monotonic() - last_used_at > DB_POOL_PING_AFTER_IDLE
+                        self._forget(conn)
+                        discarded.append(conn)
+                    if self._open < self.maxconn:
+                        self._open += 1 # reserve the slot before connecting outside the lock
+                        return None, False
+                    if not waited:
+                        self._stats['waits'] += 1
+                        waited = True
+                    remaining = DB_POOL_CHECKOUT_TIMEOUT - (time.monotonic() - started)
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        if not self._idle and self._open >= self.maxconn:
+                            self._stats['timeouts'] += 1
+                            raise pool.PoolError(f"No database connection became free within {DB_POOL_CHECKOUT_TIMEOUT}s.")
+        finally:
+            for conn in discarded:
+                self._close_quietly(conn)
+
+    def getconn(self):
+        """Checks out a healthy connection, waiting up to DB_POOL_CHECKOUT_TIMEOUT if the pool is full."""
+        started = time.monotonic()
+        while True:
+            conn, needs_ping = self._take(started)
+            if conn is None:
+                break
+            # The connection is checked out while it's pinged, so other threads carry on meanwhile
+            if not needs_ping or self._ping(conn):
+                with self._cond:
+                    return self._checked_out(conn, started)
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+                self._forget(conn)
+                self._cond.notify()
+            self._close_quietly(conn)
+
+        try:
+            conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._born_at[id(conn)] = time.monotonic()
+            self._stats['connections_opened'] += 1
+            return self._checked_out(conn, started)
+
+    def _checked_out(self, conn, started):
+        self._stats['checkouts'] += 1
+        self._stats['wait_seconds'] += time.monotonic() - started
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Returns a connection, rolling back any transaction the request left open."""
+        with self._cond:
+            if self._pid != os.getpid() or id(conn) not in self._born_at:
+                return # Borrowed before a fork or already discarded; this pool doesn't own it
+
+        # The rollback is a round trip, so it happens before taking the lock
+        if not close and not conn.closed:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+
+        discard = close or conn.closed
+        with self._cond:
+            if self._pid != os.getpid() or id(conn) not in self._born_at:
+                return
+            if discard:
+                self._forget(conn)
+            else:
+                self._idle.append((conn, self._born_at[id(conn)], time.monotonic()))
+            self._cond.notify()
+        if discard:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """A snapshot of pool counters, used to size DB_POOL_MAX_CONNECTIONS."""
+        with self._cond:
+            self._check_fork()
+            snapshot = dict(self._stats)
+            snapshot.update({
+                'pid': self._pid,
+                'maxconn': self.maxconn,
+                'open_connections': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle),
+            })
+        return snapshot
+
+    def closeall(self):
+        with self._cond:
+            if self._pid == os.getpid():
+                while self._idle:
+                    conn = self._idle.pop()[0]
+                    self._forget(conn)
+                    self._close_quietly(conn)
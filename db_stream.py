@@ -0,0 +1,42 @@
+# db_stream.py (Streaming Reads over Server-Side Cursors for the Pipeline Scripts)
+
+import os
+import itertools
+import uuid
+from psycopg2 import extensions
+from psycopg2.extras import NamedTupleCursor
+
+# --- CONFIGURATION ---
+STREAM_ITERSIZE = int(os.environ.get("DB_STREAM_ITERSIZE", 10000)) # rows per network round trip
+
+def stream_rows(conn, query, params=None, itersize=STREAM_ITERSIZE, row_type='namedtuple', withhold=False):
+    """
+    Yields the rows of `query` from a named (server-side) cursor. Postgres holds the
+    result and hands over `itersize` rows per round trip, so only one batch is ever
+    resident, however big the table is.
+
+    Rows are namedtuples (row.ein, row.name, ...) or, with row_type='tuple', plain tuples.
+    The cursor belongs to the current transaction: don't commit on `conn` until the stream
+    is consumed, unless withhold=True keeps it open across commits.
+    """
+    cursor_factory = NamedTupleCursor if row_type == 'namedtuple' else extensions.cursor
+    name = f"stream_{uuid.uuid4().hex[:16]}"
+    with conn.cursor(name=name, cursor_factory=cursor_factory, withhold=withhold) as cursor:
+        cursor.itersize = itersize
+        cursor.execute(query, params)
+        yield from cursor
+
+def stream_batches(conn, query, params=None, batch_size=STREAM_ITERSIZE, **kwargs):
+    """Like stream_rows(), but yields lists of up to `batch_size` rows, for per-batch processing."""
+    rows = stream_rows(conn, query, params, itersize=batch_size, **kwargs)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def count_rows(conn, query, params=None):
+    """Row count of `query`, for progress bars over a stream."""
+    with conn.cursor(cursor_factory=extensions.cursor) as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM ({query}) AS counted", params)
+        return cursor.fetchone()[0]
@@ -0,0 +1,100 @@
+# embedding_encoder.py (Multi-Process CPU Encoding with Optional int8 / ONNX Models)
+
+import os
+import multiprocessing
+import numpy as np
+
+# --- CONFIGURATION ---
+ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND", "fp32") # 'fp32', 'int8' (dynamic quantization) or 'onnx'
+ENCODER_THREADS = int(os.environ.get("ENCODER_THREADS", 2)) # intra-op threads per worker process
+ENCODER_PROCESSES = int(os.environ.get("ENCODER_PROCESSES", 0)) # 0 = one worker per ENCODER_THREADS cores
+ENCODER_BACKENDS = ('fp32', 'int8', 'onnx')
+# Read by OpenMP/MKL/OpenBLAS (torch) and onnxruntime when a worker starts
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+def encoder_cache_name(model_name, backend=ENCODER_BACKEND):
+    """
+    Names the vectors a backend produces, for the embedding cache. int8 and ONNX vectors
+    drift slightly from fp32, so they're never mixed with the baseline's.
+    """
+    return model_name if backend == 'fp32' else f"{model_name}:{backend}"
+
+def load_model(model_name, backend=ENCODER_BACKEND):
+    """Loads a SentenceTransformer for CPU inference in the given backend."""
+    from sentence_transformers import SentenceTransformer
+    if backend == 'fp32':
+        return SentenceTransformer(model_name, device='cpu')
+    if backend == 'int8':
+        # Dynamic quantization: Linear weights stored as int8, activations quantized per batch
+        import torch
+        model = SentenceTransformer(model_name, device='cpu')
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == 'onnx':
+        # Needs sentence-transformers >= 3.2 with its onnx extra (optimum + onnxruntime)
+        return SentenceTransformer(model_name, device='cpu', backend='onnx')
+    raise ValueError(f"Unknown encoder backend '{backend}'; expected one of {ENCODER_BACKENDS}.")
+
+# --- GLOBAL MODEL FOR WORKERS ---
+encoder_model_global = None
+
+def init_encoder_worker(model_name, backend, threads):
+    """Pins the worker's thread count, then loads its own copy of the model."""
+    global encoder_model_global
+    import torch
+    torch.set_num_threads(threads)
+    encoder_model_global = load_model(model_name, backend)
+
+def encode_slice(args):
+    texts, batch_size = args
+    return encoder_model_global.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+
+class EncoderPool:
+    """
+    Spreads encoding over worker processes, one model per worker, each limited to
+    `threads` intra-op threads so that processes x threads never exceeds the cores.
+    encode() has SentenceTransformer's signature, so it drops into encode_length_sorted():
+    texts are cut into contiguous forward-pass slices (length-sorted input keeps each
+    slice's padding low) and the vectors come back in input order.
+    """
+    def __init__(self, model_name, backend=ENCODER_BACKEND, processes=ENCODER_PROCESSES, threads=ENCODER_THREADS):
+        self.model_name = model_name
+        self.backend = backend
+        self.threads = max(1, threads)
+        self.processes = processes or max(1, (os.cpu_count() or 1) // self.threads)
+        self.cache_name = encoder_cache_name(model_name, backend)
+
+        # Workers are spawned, not forked: forking a process whose torch/OpenMP thread pools
+        # are already running can deadlock. They inherit the thread limits from the environment.
+        saved = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+        os.environ.update({var: str(self.threads) for var in THREAD_ENV_VARS})
+        try:
+            self._pool = multiprocessing.get_context('spawn').Pool(
+                processes=self.processes, initializer=init_encoder_worker,
+                initargs=(model_name, backend, self.threads))
+        finally:
+            for var, value in saved.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        slices = [(texts[i:i + batch_size], batch_size) for i in range(0, len(texts), batch_size)]
+        return np.vstack(self._pool.map(encode_slice, slices, chunksize=1))
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0]:
+            self._pool.terminate()
+        else:
+            self.close()
+        return False
@@ -0,0 +1,116 @@
+# embedding_pipeline.py (Streaming, Batched Grant Embedding with a Content-Addressed Cache)
+
+import time
+import hashlib
+import numpy as np
+from tqdm import tqdm
+
+from db_stream import stream_batches, count_rows
+from bulk_loader import bulk_insert, bulk_update
+from match_cache import normalize_mission as normalize_text
+
+# --- CONFIGURATION ---
+WRITE_BATCH_SIZE = 5000 # grants read, encoded, written and committed together
+ENCODE_BATCH_SIZE = 128 # texts per forward pass of the model
+# Grants with no embedding, or one made by another model or backend (grants.embedding_model)
+PENDING_QUERY = """
+    SELECT id, grant_purpose FROM grants
+    WHERE grant_purpose IS NOT NULL AND (embedding IS NULL OR embedding_model IS DISTINCT FROM %(model_name)s)
+"""
+
+def ensure_embedding_cache_schema(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            text_hash TEXT PRIMARY KEY,
+            model_name TEXT NOT NULL,
+            embedding public.vector(384) NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    # The encoder (model, plus backend unless fp32) that produced each grant's embedding
+    cursor.execute("ALTER TABLE grants ADD COLUMN IF NOT EXISTS embedding_model TEXT;")
+
+def embedding_cache_key(normalized_text, model_name):
+    """
+    The key covers both inputs of an embedding: the normalized text and the model,
+    so switching models never reads vectors computed by another one.
+    """
+    return hashlib.sha256(f"{model_name}\n{normalized_text}".encode('utf-8')).hexdigest()
+
+def encode_length_sorted(model, texts, encode_batch_size=ENCODE_BATCH_SIZE):
+    """
+    Encodes texts shortest first, so each forward pass pads to similar lengths, and
+    returns the vectors in the original order.
+    """
+    order = np.argsort([len(text) for text in texts], kind='stable')
+    vectors = model.encode([texts[i] for i in order], batch_size=encode_batch_size, show_progress_bar=False)
+    embeddings = np.empty_like(vectors)
+    embeddings[order] = vectors
+    return embeddings
+
+def embed_texts_cached(cursor, model, model_name, texts, encode_batch_size=ENCODE_BATCH_SIZE):
+    """
+    Returns one vector per text, encoding each distinct normalized text at most once:
+    vectors already in embedding_cache are reused, the rest are encoded and added to it.
+    Returns (embeddings, texts_encoded).
+    """
+    keys = [embedding_cache_key(normalize_text(text), model_name) for text in texts]
+    # One representative normalized text per distinct key
+    distinct = {}
+    for key, text in zip(keys, texts):
+        distinct.setdefault(key, text)
+
+    cursor.execute("SELECT text_hash, embedding FROM embedding_cache WHERE text_hash = ANY(%s)", (list(distinct),))
+    vectors = {row['text_hash']: np.asarray(row['embedding'], dtype=np.float32) for row in cursor.fetchall()}
+
+    missing = [key for key in distinct if key not in vectors]
+    if missing:
+        # The cached vector is a function of the key alone, so encode the normalized text
+        encoded = encode_length_sorted(model, [normalize_text(distinct[key]) for key in missing], encode_batch_size)
+        bulk_insert(cursor, 'embedding_cache', ['text_hash', 'model_name', 'embedding'],
+                    ((key, model_name, vector) for key, vector in zip(missing, encoded)), report=False)
+        vectors.update(zip(missing, encoded))
+
+    return [vectors[key] for key in keys], len(missing)
+
+def embed_pending_grants(conn, model, model_name, limit=None, batch_size=WRITE_BATCH_SIZE, encode_batch_size=ENCODE_BATCH_SIZE):
+    """
+    Embeds every grant that has a purpose but no embedding from `model_name` (the encoder's
+    cache name, which also names its backend). Texts stream from a server-side
+    cursor; each batch's distinct purposes are looked up in (or added to) embedding_cache,
+    fanned out to their grants with one COPY-fed UPDATE ... FROM join and committed. Memory
+    stays flat, and an interrupted run resumes by running again, since only rows still
+    missing an embedding from this encoder are selected. Switching backends re-embeds
+    every grant, so the table never mixes vectors from two encoders.
+    Returns {'rows', 'encoded', 'seconds', 'rows_per_second'}.
+    """
+    with conn.cursor() as cursor:
+        ensure_embedding_cache_schema(cursor)
+    conn.commit()
+
+    query = PENDING_QUERY + (f" LIMIT {int(limit)}" if limit else "")
+    params = {'model_name': model_name}
+    total = count_rows(conn, query, params)
+    started = time.perf_counter()
+    embedded = encoded = 0
+    if total:
+        print(f"Found {total} grants to embed. Processing in batches of {batch_size}...")
+        with tqdm(total=total, desc="Embedding Grants") as progress:
+            # WITH HOLD keeps the stream open across the per-batch commits
+            for batch in stream_batches(conn, query, params, batch_size=batch_size, row_type='tuple', withhold=True):
+                with conn.cursor() as cursor:
+                    embeddings, batch_encoded = embed_texts_cached(
+                        cursor, model, model_name, [purpose for _, purpose in batch], encode_batch_size)
+                    bulk_update(cursor, 'grants', ['id'], ['embedding', 'embedding_model'],
+                                ((grant_id, embedding, model_name) for (grant_id, _), embedding in zip(batch, embeddings)),
+                                report=False)
+                conn.commit()
+                embedded += len(batch)
+                encoded += batch_encoded
+                progress.update(len(batch))
+                progress.set_postfix(encoded=encoded)
+
+    seconds = max(time.perf_counter() - started, 1e-9)
+    if embedded:
+        print(f"Encoded {encoded:,} distinct purposes for {embedded:,} grants; the rest came from the embedding cache.")
+    return {'rows': embedded, 'encoded': encoded, 'seconds': seconds, 'rows_per_second': embedded / seconds}
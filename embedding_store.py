@@ -0,0 +1,149 @@
+# embedding_store.py (Binary, Memory-Mapped Grant Embeddings)
+
+import os
+import json
+import struct
+import hashlib
+import numpy as np
+
+# --- CONFIGURATION ---
+EMBEDDING_STORE_PATH = os.environ.get("EMBEDDING_STORE_PATH", "grant_embeddings.bin")
+STORE_MAGIC = b'GEMB'
+STORE_FORMAT_VERSION = 1
+HEADER_ALIGNMENT = 64 # Keeps the id array and matrix page/SIMD friendly
+SUPPORTED_DTYPES = ('float32', 'float16')
+
+# File layout:
+#   4 bytes   magic 'GEMB'
+#   4 bytes   little-endian uint32 length of the JSON header
+#   N bytes   JSON header (model_name, encoder, dim, count, dtype, checksum, offsets), padded to 64 bytes
+#   count * 8 bytes              int64 grant ids
+#   count * dim * itemsize bytes row-major embedding matrix
+
+class EmbeddingStore:
+    """A read-only view of an on-disk embedding store. Arrays are memory-mapped, not copied."""
+    def __init__(self, path, header, grant_ids, embeddings):
+        self.path = path
+        self.header = header
+        self.grant_ids = grant_ids
+        self.embeddings = embeddings
+
+    @property
+    def model_name(self):
+        return self.header['model_name']
+
+    @property
+    def encoder(self):
+        """The encoder that produced the vectors, e.g. 'all-MiniLM-L6-v2:int8' (the model name for fp32)."""
+        return self.header.get('encoder', self.header['model_name'])
+
+    @property
+    def version(self):
+        """The payload checksum doubles as a version id for the published index."""
+        return self.header['checksum']
+
+    def __len__(self):
+        return self.header['count']
+
+def _align(offset):
+    return (offset + HEADER_ALIGNMENT - 1) // HEADER_ALIGNMENT * HEADER_ALIGNMENT
+
+def _payload_checksum(grant_ids, embeddings):
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(grant_ids))
+    digest.update(np.ascontiguousarray(embeddings))
+    return digest.hexdigest()
+
+def write_embedding_store(path, grant_ids, embeddings, model_name, dtype='float32', encoder=None):
+    """
+    Writes grant ids and their embedding matrix to `path`. The file is written next to
+    the target and swapped in with os.replace, so processes that already have the old
+    store mapped keep reading a consistent file. `encoder` names the backend that made
+    the vectors (see embedding_encoder.encoder_cache_name); it defaults to fp32's name.
+    Rows are scaled to unit length before any float16 rounding, so readers can search the
+    mapped matrix directly instead of each keeping a normalized float32 copy.
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype '{dtype}'. Expected one of {SUPPORTED_DTYPES}.")
+
+    grant_ids = np.ascontiguousarray(grant_ids, dtype='<i8')
+    embeddings = np.array(embeddings, dtype=np.float32)
+    if embeddings.ndim == 2:
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    embeddings = np.ascontiguousarray(embeddings, dtype='<f4' if dtype == 'float32' else '<f2')
+    if embeddings.ndim != 2 or embeddings.shape[0] != grant_ids.shape[0]:
+        raise ValueError("Embeddings must be a 2-D matrix with one row per grant id.")
+
+    count, dim = embeddings.shape
+    header = {
+        'format_version': STORE_FORMAT_VERSION,
+        'model_name': model_name,
+        'encoder': encoder or model_name,
+        'dim': dim,
+        'count': count,
+        'dtype': dtype,
+        'checksum': _payload_checksum(grant_ids, embeddings),
+    }
+
+    # The offsets depend on the header length and vice versa, so settle them iteratively.
+    header['ids_offset'] = header['matrix_offset'] = 0
+    while True:
+        header_bytes = json.dumps(header).encode('utf-8')
+        ids_offset = _align(8 + len(header_bytes))
+        matrix_offset = _align(ids_offset + grant_ids.nbytes)
+        if (ids_offset, matrix_offset) == (header['ids_offset'], header['matrix_offset']):
+            break
+        header['ids_offset'], header['matrix_offset'] = ids_offset, matrix_offset
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(STORE_MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        f.seek(header['ids_offset'])
+        f.write(grant_ids)
+        f.seek(header['matrix_offset'])
+        f.write(embeddings)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return header
+
+def read_store_header(path):
+    """Reads and validates only the header of an embedding store."""
+    with open(path, 'rb') as f:
+        if f.read(4) != STORE_MAGIC:
+            raise ValueError(f"'{path}' is not a grant embedding store.")
+        (header_len,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    if header.get('format_version') != STORE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported embedding store version {header.get('format_version')} in '{path}'.")
+    return header
+
+def load_embedding_store(path=EMBEDDING_STORE_PATH, expected_model=None, expected_encoder=None, verify=False):
+    """
+    Memory-maps an embedding store. Mapping is copy-on-write, so every process that loads
+    the same file shares its page-cache pages until something writes to the arrays.
+    Pass expected_encoder to refuse vectors from another backend than the one encoding
+    queries, and verify=True to recompute the checksum (this reads the whole file).
+    """
+    header = read_store_header(path)
+    if expected_model and header['model_name'] != expected_model:
+        raise ValueError(f"Embedding store was built with '{header['model_name']}', expected '{expected_model}'.")
+    encoder = header.get('encoder', header['model_name'])
+    if expected_encoder and encoder != expected_encoder:
+        raise ValueError(f"Embedding store was encoded by '{encoder}', expected '{expected_encoder}'.")
+
+    count, dim = header['count'], header['dim']
+    dtype = '<f4' if header['dtype'] == 'float32' else '<f2'
+    if count == 0:
+        # mmap cannot map an empty region
+        return EmbeddingStore(path, header, np.empty(0, dtype='<i8'), np.empty((0, dim), dtype=dtype))
+
+    grant_ids = np.memmap(path, dtype='<i8', mode='c', offset=header['ids_offset'], shape=(count,))
+    embeddings = np.memmap(path, dtype=dtype, mode='c', offset=header['matrix_offset'], shape=(count, dim))
+
+    if verify and _payload_checksum(grant_ids, embeddings) != header['checksum']:
+        raise ValueError(f"Checksum mismatch in embedding store '{path}'.")
+
+    return EmbeddingStore(path, header, grant_ids, embeddings)
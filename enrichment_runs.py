@@ -0,0 +1,151 @@
+# enrichment_runs.py (Chunked, Resumable Grant Enrichment Runs with Checkpoints)
+
+from collections import Counter
+from multiprocessing import Pool
+from tqdm import tqdm
+
+from bulk_loader import bulk_update
+from charity_index import chunk_grants
+from name_normalizer import CURRENT_VERSION as NORMALIZER_VERSION
+from fuzzy_matcher import MATCHER_VERSION
+
+# --- CONFIGURATION ---
+FETCH_CHUNK_SIZE = 20000 # grants fetched, matched and committed per checkpoint
+
+def ensure_match_columns(cursor):
+    """The provenance columns every matcher writes next to grants.recipient_ein_matched."""
+    cursor.execute("ALTER TABLE grants ADD COLUMN IF NOT EXISTS match_method TEXT;")
+    cursor.execute("ALTER TABLE grants ADD COLUMN IF NOT EXISTS match_score REAL;")
+
+def ensure_run_state_schema(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS enrichment_runs (
+            run_name TEXT PRIMARY KEY,
+            matcher_version TEXT NOT NULL,
+            score_cutoff INTEGER,
+            last_grant_id INTEGER NOT NULL DEFAULT 0,
+            grants_attempted BIGINT NOT NULL DEFAULT 0,
+            grants_matched BIGINT NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'running',
+            started_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    # {run_name: matcher version} for every run that has attempted the grant, so runs don't overwrite each other
+    cursor.execute("ALTER TABLE grants ADD COLUMN IF NOT EXISTS match_attempts JSONB;")
+    ensure_match_columns(cursor)
+
+def matcher_version(rules, score_cutoff):
+    """
+    Identifies the matching rules: normalizer, matcher, blocking (or cascade) and cutoff.
+    A run skips grants it already attempted under the same version; any change re-attempts everything.
+    """
+    return f"{NORMALIZER_VERSION}/{MATCHER_VERSION}/{rules}/{score_cutoff}"
+
+def start_run(cursor, run_name, version, score_cutoff, restart=False):
+    """
+    Returns the grant id to resume after: the checkpoint if an unfinished run wrote it under
+    `version`, else 0. A completed run starts again from the first grant, so grants loaded
+    since (including a reload that restarted the id sequence) are picked up; the ones it
+    already attempted are skipped by the grant query. `restart` also forgets which grants
+    this run attempted, so every unmatched grant is attempted again.
+    """
+    cursor.execute("SELECT matcher_version, last_grant_id, status FROM enrichment_runs WHERE run_name = %s FOR UPDATE", (run_name,))
+    checkpoint = cursor.fetchone()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM grants")
+    max_id = cursor.fetchone()['max_id']
+
+    if (checkpoint and not restart and checkpoint['matcher_version'] == version and checkpoint['status'] != 'complete'
+            and checkpoint['last_grant_id'] <= max_id):
+        print(f"Resuming '{run_name}' after grant id {checkpoint['last_grant_id']} (last status: {checkpoint['status']}).")
+        cursor.execute("UPDATE enrichment_runs SET status = 'running', updated_at = CURRENT_TIMESTAMP WHERE run_name = %s", (run_name,))
+        return checkpoint['last_grant_id']
+
+    if restart:
+        print(f"Restarting '{run_name}': clearing its record of attempted grants...")
+        cursor.execute("UPDATE grants SET match_attempts = match_attempts - %s::text WHERE match_attempts ? %s",
+                       (run_name, run_name))
+    elif checkpoint and checkpoint['last_grant_id'] > max_id:
+        print("Checkpoint is past the newest grant (the table was reloaded); starting over.")
+    elif checkpoint and checkpoint['status'] == 'complete':
+        print(f"'{run_name}' last ran to completion; checking every grant not yet attempted by it.")
+    print(f"Starting '{run_name}' from the first grant under matcher version {version}.")
+    cursor.execute("""
+        INSERT INTO enrichment_runs (run_name, matcher_version, score_cutoff)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (run_name) DO UPDATE SET
+            matcher_version = EXCLUDED.matcher_version, score_cutoff = EXCLUDED.score_cutoff,
+            last_grant_id = 0, grants_attempted = 0, grants_matched = 0, status = 'running',
+            started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+    """, (run_name, version, score_cutoff))
+    return 0
+
+def save_chunk(cursor, run_name, version, grants, updates):
+    """
+    Writes one chunk's (grant_id, ein, match_method, match_score) matches, marks every
+    grant in it as attempted by this run and advances the checkpoint.
+    """
+    if updates:
+        bulk_update(cursor, 'grants', ['id'], ['recipient_ein_matched', 'match_method', 'match_score'],
+                    updates, report=False)
+    cursor.execute("""
+        UPDATE grants SET match_attempts = COALESCE(match_attempts, '{}'::jsonb) || jsonb_build_object(%s::text, %s::text)
+        WHERE id = ANY(%s)
+    """, (run_name, version, [grant['id'] for grant in grants]))
+    cursor.execute("""
+        UPDATE enrichment_runs
+        SET last_grant_id = %s, grants_attempted = grants_attempted + %s,
+            grants_matched = grants_matched + %s, updated_at = CURRENT_TIMESTAMP
+        WHERE run_name = %s
+    """, (grants[-1]['id'], len(grants), len(updates), run_name))
+
+def run_enrichment(conn, run_name, grant_query, version, score_cutoff, match_chunk,
+                   init_worker, initargs, num_processes, restart=False):
+    """
+    Runs `match_chunk` over all matching grants in id order, FETCH_CHUNK_SIZE at a time.
+    `match_chunk` takes a chunk_grants() chunk and returns (grant_id, ein, method, score) matches.
+    Each fetched chunk's matches and checkpoint are committed together, so a crash only
+    loses the chunk in flight and the next run resumes after the last committed id.
+
+    `grant_query` must select id, recipient_name (and state, if used) for grants with
+    id > %(last_id)s whose match_attempts ->> %(run_name)s IS DISTINCT FROM %(version)s,
+    ORDER BY id LIMIT %(limit)s.
+    `conn` is expected to use RealDictCursor, like the enrichment scripts.
+    """
+    with conn.cursor() as cursor:
+        ensure_run_state_schema(cursor)
+        last_id = start_run(cursor, run_name, version, score_cutoff, restart)
+    conn.commit()
+
+    attempted = 0
+    matched = Counter() # matches per match_method
+    with Pool(processes=num_processes, initializer=init_worker, initargs=initargs) as pool, \
+            tqdm(desc="Enriching Grants", unit="grant") as progress:
+        while True:
+            with conn.cursor() as cursor:
+                cursor.execute(grant_query, {'last_id': last_id, 'run_name': run_name, 'version': version,
+                                             'limit': FETCH_CHUNK_SIZE})
+                grants = cursor.fetchall()
+            if not grants:
+                break
+
+            updates = []
+            for chunk_updates in pool.imap_unordered(match_chunk, chunk_grants(grants)):
+                updates.extend(chunk_updates)
+            with conn.cursor() as cursor:
+                save_chunk(cursor, run_name, version, grants, updates)
+            conn.commit()
+
+            last_id = grants[-1]['id']
+            attempted += len(grants)
+            matched.update(method for _, _, method, _ in updates)
+            progress.update(len(grants))
+            progress.set_postfix(matched=sum(matched.values()), last_id=last_id)
+
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE enrichment_runs SET status = 'complete', updated_at = CURRENT_TIMESTAMP WHERE run_name = %s", (run_name,))
+    conn.commit()
+    print(f"\n'{run_name}' complete: {sum(matched.values()):,} new matches from {attempted:,} grants attempted this run.")
+    for method, count in matched.most_common():
+        print(f"  {method}: {count:,}")
+    return matched
@@ -0,0 +1,126 @@
+# fake_llm_server.py (Local Stand-In for Gemini's generateContent Endpoint)
+
+import re
+import json
+import random
+import asyncio
+import argparse
+import time
+from collections import Counter
+from aiohttp import web
+
+# --- CONFIGURATION ---
+DEFAULT_PORT = 8089
+DEFAULT_PURPOSE = "For general charitable purposes"
+
+class FakeGemini:
+    """
+    Answers POST /v1beta/models/<model>:generateContent like Gemini does, with a fixed
+    latency, an optional requests-per-minute quota (429 + Retry-After when exceeded) and
+    randomly injected 429/503 failures, so the generator's limits and retries can be
+    exercised without spending quota. Batch prompts (JSON response type) get a JSON array
+    back, with `malformed_rate` of its items dropped or garbled to exercise the fallback.
+    GET /stats returns the counts of what it served.
+    """
+    def __init__(self, latency=0.05, requests_per_minute=None, error_rate=0.0, throttle_rate=0.0,
+                 malformed_rate=0.0, seed=0):
+        self.latency = latency
+        self.malformed_rate = malformed_rate
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self.in_flight = 0
+        self._window = [] # request times within the last minute
+
+    def respond(self, prompt):
+        """The purpose the fake model 'generates': derived from the recipient name in the prompt."""
+        recipient = re.search(r'organization named: "(.*?)"', prompt)
+        if not recipient:
+            return DEFAULT_PURPOSE
+        return f'"To support the programs of {recipient.group(1).title()}."'
+
+    def respond_batch(self, prompt):
+        """A JSON array answering every numbered recipient in a batch prompt, some items spoiled."""
+        items = []
+        for number, recipient in re.findall(r'^\s*\[(\d+)\] (.*)$', prompt, re.MULTILINE):
+            item = {'id': int(number), 'purpose': f"To support the programs of {recipient.strip().title()}."}
+            if self.random.random() < self.malformed_rate:
+                self.stats['malformed_items'] += 1
+                spoil = self.random.choice(('drop', 'id', 'purpose'))
+                if spoil == 'drop':
+                    continue
+                item['id' if spoil == 'id' else 'purpose'] = None
+            items.append(item)
+        return json.dumps(items)
+
+    def _over_quota(self):
+        if not self.requests_per_minute:
+            return False
+        now = time.monotonic()
+        self._window = [t for t in self._window if now - t < 60]
+        if len(self._window) >= self.requests_per_minute:
+            return True
+        self._window.append(now)
+        return False
+
+    async def generate_content(self, request):
+        self.stats['requests'] += 1
+        self.in_flight += 1
+        self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self._over_quota() or self.random.random() < self.throttle_rate:
+                self.stats['429'] += 1
+                return web.json_response({'error': {'code': 429, 'status': 'RESOURCE_EXHAUSTED'}},
+                                         status=429, headers={'Retry-After': '1'})
+            if self.random.random() < self.error_rate:
+                self.stats['503'] += 1
+                return web.json_response({'error': {'code': 503, 'status': 'UNAVAILABLE'}}, status=503)
+            body = await request.json()
+            prompt = body['contents'][0]['parts'][0]['text']
+            self.stats['200'] += 1
+            if (body.get('generationConfig') or {}).get('responseMimeType') == 'application/json':
+                self.stats['batch_requests'] += 1
+                text = self.respond_batch(prompt)
+            else:
+                text = self.respond(prompt)
+            return web.json_response({'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'},
+                                                      'finishReason': 'STOP'}]})
+        finally:
+            self.in_flight -= 1
+
+    async def get_stats(self, request):
+        return web.json_response(dict(self.stats))
+
+    def app(self):
+        app = web.Application()
+        # The model and method share one path segment ("gemini-1.5-flash:generateContent")
+        app.router.add_post('/v1beta/models/{model_method}', self.generate_content)
+        app.router.add_get('/stats', self.get_stats)
+        return app
+
+async def start_fake_server(fake, port=DEFAULT_PORT, host='127.0.0.1'):
+    """Serves `fake` from the running event loop; returns the runner to clean up when done."""
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini API.")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per response")
+    parser.add_argument('--rpm', type=int, default=None, help="requests per minute before answering 429")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered 503")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of requests answered 429")
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help="fraction of batch items dropped or garbled")
+    args = parser.parse_args()
+
+    fake = FakeGemini(args.latency, args.rpm, args.error_rate, args.throttle_rate, args.malformed_rate)
+    print(f"Fake Gemini listening on http://127.0.0.1:{args.port} (set GEMINI_API_BASE to this URL)")
+    web.run_app(fake.app(), host='127.0.0.1', port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
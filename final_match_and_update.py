@@ -8,6 +8,9 @@ import psycopg2
 from psycopg2.extras import RealDictCursor, execute_batch
 from tqdm import tqdm
 
+from db_stream import stream_rows, count_rows
+from enrichment_runs import ensure_match_columns
+
 def main():
     conn = None
     try:
@@ -18,41 +21,39 @@ def main():
         
         print("--- Starting Definitive Grant Enrichment ---")
 
-        with conn.cursor() as cursor:
-            # Step 1: Fetch all charity EINs into a fast Python set
-            print("Fetching all charity EINs into memory...")
-            cursor.execute("SELECT ein FROM charities;")
-            # This TRIMs any whitespace during the fetch
-            charity_eins = {row['ein'].strip() for row in cursor.fetchall() if row['ein']}
-            print(f"Loaded {len(charity_eins)} unique charity EINs.")
-
-            # Step 2: Fetch all unmatched grants that have a recipient EIN
-            print("Fetching all processable unmatched grants...")
-            cursor.execute("""
-                SELECT id, recipient_ein 
-                FROM grants 
-                WHERE recipient_ein IS NOT NULL AND recipient_ein_matched IS NULL;
-            """)
-            unmatched_grants = cursor.fetchall()
+        # Step 1: Stream all charity EINs into a fast Python set
+        print("Fetching all charity EINs into memory...")
+        # This TRIMs any whitespace during the fetch
+        charity_eins = {ein.strip() for ein, in stream_rows(conn, "SELECT ein FROM charities", row_type='tuple') if ein}
+        print(f"Loaded {len(charity_eins)} unique charity EINs.")
 
-        if not unmatched_grants:
+        # Step 2: Stream the unmatched grants that have a recipient EIN
+        grants_query = """
+            SELECT id, recipient_ein
+            FROM grants
+            WHERE recipient_ein IS NOT NULL AND recipient_ein_matched IS NULL
+        """
+        grant_count = count_rows(conn, grants_query)
+        if not grant_count:
             print("No unmatched grants with recipient EINs were found.")
             return
 
-        print(f"Found {len(unmatched_grants)} grants to check. Performing match in memory...")
-        
-        # Step 3: Find the intersection in Python
+        print(f"Found {grant_count} grants to check. Performing match while streaming...")
+
+        # Step 3: Find the intersection in Python; only the matches are kept in memory
         updates_to_make = []
-        for grant in tqdm(unmatched_grants, desc="Matching Grants"):
+        for grant_id, recipient_ein in tqdm(stream_rows(conn, grants_query, row_type='tuple'), total=grant_count, desc="Matching Grants"):
             # We TRIM the grant's recipient_ein here to match the clean set
-            if grant['recipient_ein'] and grant['recipient_ein'].strip() in charity_eins:
-                updates_to_make.append((grant['recipient_ein'].strip(), grant['id']))
+            if recipient_ein and recipient_ein.strip() in charity_eins:
+                updates_to_make.append((recipient_ein.strip(), grant_id))
 
         # Step 4: Perform the final, targeted update
         if updates_to_make:
             print(f"\nFound {len(updates_to_make)} direct EIN matches. Updating database...")
             with conn.cursor() as cursor:
-                execute_batch(cursor, "UPDATE grants SET recipient_ein_matched = %s WHERE id = %s", updates_to_make)
+                ensure_match_columns(cursor)
+                # Same provenance as the cascade's first stage (match_cascade.py)
+                execute_batch(cursor, "UPDATE grants SET recipient_ein_matched = %s, match_method = 'exact_ein', match_score = 100 WHERE id = %s", updates_to_make)
                 conn.commit()
             print(f"Successfully updated {len(updates_to_make)} grant records.")
         else:
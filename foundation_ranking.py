@@ -0,0 +1,125 @@
+# foundation_ranking.py (Foundation-Level Ranking Engine for /api/matches)
+
+import numpy as np
+
+# --- CONFIGURATION ---
+CANDIDATE_GRANTS = 250 # grant hits rolled up into foundations, as in test_matchmaking.py
+FOUNDATION_TOP_K = None # best hits kept per foundation before pooling; None keeps them all
+POOLING = 'mean' # 'mean', 'max' or 'softmax'
+SOFTMAX_TEMPERATURE = 0.05
+TOP_GRANTS_PER_FOUNDATION = 3
+# Blend weights for the final 0-100 match score. They should sum to 1.
+SCORE_WEIGHTS = {
+    'similarity': 0.7,
+    'financial_score': 0.1,
+    'national_funder_score': 0.1,
+    'geo_score': 0.1,
+}
+
+def fetch_hit_rows(cursor, ranked_hits, user_id):
+    """
+    Loads every hit's grant, foundation and precomputed scores in one query. The geo score
+    is computed against the state of the user's charity when their profile links one.
+    """
+    cursor.execute("""
+        WITH hits AS (
+            SELECT grant_id, rank FROM unnest(%s::int[]) WITH ORDINALITY AS r(grant_id, rank)
+        ),
+        user_state AS (
+            SELECT c.state
+            FROM charity_profiles cp
+            JOIN charities c ON c.ein = cp.charity_ein
+            WHERE cp.user_id = %s
+        )
+        SELECT
+            h.rank, g.id AS grant_id, g.grant_purpose, g.grant_amount,
+            f.ein, f.name, f.city, f.state,
+            COALESCE(fs.financial_score, 0) AS financial_score,
+            COALESCE(fs.national_funder_score, 0) AS national_funder_score,
+            fs.smart_ask_amount,
+            COALESCE((SELECT calculate_geo_score(us.state, f.state) FROM user_state us), 0) AS geo_score
+        FROM hits h
+        JOIN grants g ON g.id = h.grant_id
+        JOIN foundations f ON g.foundation_ein = f.ein
+        LEFT JOIN foundation_scores fs ON fs.foundation_ein = f.ein
+        ORDER BY h.rank
+    """, ([int(grant_id) for grant_id, _ in ranked_hits], user_id))
+    return cursor.fetchall()
+
+def _pool(group_codes, similarities, group_max, group_count, pooling):
+    if pooling == 'max':
+        return group_max
+    if pooling == 'softmax':
+        # Softmax-weighted mean: dominated by the best hits, but a deep bench still counts.
+        weights = np.exp((similarities - group_max[group_codes]) / SOFTMAX_TEMPERATURE)
+        return (np.bincount(group_codes, weights=weights * similarities, minlength=len(group_max))
+                / np.bincount(group_codes, weights=weights, minlength=len(group_max)))
+    if pooling == 'mean':
+        return np.bincount(group_codes, weights=similarities, minlength=len(group_max)) / group_count
+    raise ValueError(f"Unknown pooling '{pooling}'. Expected 'mean', 'max' or 'softmax'.")
+
+def rank_foundations(cursor, ranked_hits, user_id, limit=25, pooling=POOLING, top_k=FOUNDATION_TOP_K):
+    """
+    Rolls ranked grant hits up to foundations in one query and one vectorized pass:
+    per-foundation top-k, pooled similarity, then a blend with the precomputed scores.
+    Returns foundation dicts with a 0-100 `score`, best first.
+    """
+    if not ranked_hits:
+        return []
+    rows = fetch_hit_rows(cursor, ranked_hits, user_id)
+    if not rows:
+        return []
+
+    similarity_by_rank = np.array([score for _, score in ranked_hits], dtype=np.float64)
+    similarities = similarity_by_rank[np.array([row['rank'] for row in rows]) - 1]
+    eins, group_codes = np.unique([row['ein'] for row in rows], return_inverse=True)
+    group_codes = group_codes.ravel()
+
+    # Sort by foundation, then best hit first, and number each hit within its foundation.
+    order = np.lexsort((-similarities, group_codes))
+    sorted_codes = group_codes[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(order)])
+    rank_in_group = np.arange(len(order)) - np.repeat(group_starts, group_sizes)
+
+    kept = order[rank_in_group < top_k] if top_k else order
+    kept_codes = group_codes[kept]
+    kept_similarities = similarities[kept]
+    group_count = np.bincount(kept_codes, minlength=len(eins))
+    group_max = similarities[order[group_starts]]
+    pooled = _pool(kept_codes, kept_similarities, group_max, group_count, pooling)
+
+    # Foundation-level columns are identical on every hit row, so read them from each group's first row.
+    first_rows = [rows[i] for i in order[group_starts]]
+    def column(name):
+        return np.array([float(row[name] or 0) for row in first_rows])
+
+    blended = SCORE_WEIGHTS['similarity'] * pooled
+    for name in ('financial_score', 'national_funder_score', 'geo_score'):
+        blended += SCORE_WEIGHTS[name] * column(name) / 100.0
+    blended *= 100.0
+
+    results = []
+    for code in np.argsort(-blended, kind='stable')[:limit]:
+        start = group_starts[code]
+        best_hits = order[start:start + min(group_sizes[code], TOP_GRANTS_PER_FOUNDATION)]
+        foundation = first_rows[code]
+        results.append({
+            'ein': foundation['ein'],
+            'name': foundation['name'],
+            'city': foundation['city'],
+            'state': foundation['state'],
+            'score': float(blended[code]),
+            'similarity': float(pooled[code]),
+            'matching_grants': int(group_sizes[code]),
+            'smart_ask_amount': float(foundation['smart_ask_amount']) if foundation['smart_ask_amount'] is not None else None,
+            'financial_score': int(foundation['financial_score']),
+            'national_funder_score': int(foundation['national_funder_score']),
+            'geo_score': int(foundation['geo_score']),
+            'top_grants': [{
+                'grant_purpose': rows[i]['grant_purpose'],
+                'grant_amount': float(rows[i]['grant_amount']) if rows[i]['grant_amount'] is not None else None,
+                'similarity': float(similarities[i]),
+            } for i in best_hits],
+        })
+    return results
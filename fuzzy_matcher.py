@@ -0,0 +1,261 @@
+# fuzzy_matcher.py (Blocked Fuzzy Name Matching with an N-Gram Candidate Index)
+
+import os
+import json
+import shutil
+import zlib
+from array import array
+from bisect import bisect_left
+import numpy as np
+from rapidfuzz import fuzz, process, utils
+
+# --- CONFIGURATION ---
+NGRAM_SIZE = 3
+MAX_CANDIDATES = 40 # names per shortlist; a query scores the union of two shortlists (see candidates())
+# Grams shared by more than this fraction of a group's names (' th', 'er ', ...) barely
+# narrow the search, so they are skipped when at least half of a query's grams are more selective.
+COMMON_GRAM_FRACTION = 0.05
+MIN_COMMON_GRAM_POSTINGS = 500
+# Recorded with enrichment results; bump the suffix when scoring changes in a way the settings don't show
+MATCHER_VERSION = f"ngram{NGRAM_SIZE}-top{MAX_CANDIDATES}-wratio-2"
+INDEX_FORMAT_VERSION = 1
+INDEX_ARRAYS = ('group_bounds', 'name_offsets', 'name_blob', 'values', 'gram_counts',
+                'gram_keys', 'gram_offsets', 'gram_ids')
+
+def _ngrams(text, n=NGRAM_SIZE):
+    padded = f" {text} "
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+def _top(scores, k):
+    return np.argpartition(-scores, k - 1)[:k]
+
+def _gram_key(group_id, gram):
+    # A crc32 collision only adds a candidate; scoring still decides the match.
+    return (group_id << 32) | zlib.crc32(gram.encode('utf-8'))
+
+class _GroupNames:
+    """Sequence view of one group's sorted, UTF-8 encoded names, for binary search."""
+    def __init__(self, index, lo, hi):
+        self._index, self._lo, self._hi = index, lo, hi
+
+    def __len__(self):
+        return self._hi - self._lo
+
+    def __getitem__(self, i):
+        return self._index.name_bytes(self._lo + i)
+
+class NameIndex:
+    """
+    Compact, read-only fuzzy-matching index over groups of names (charities per state,
+    for example). Everything lives in flat numpy arrays:
+      - names, preprocessed and sorted within each group, as one UTF-8 blob plus offsets
+      - one value (e.g. an EIN) per name
+      - a character n-gram inverted index (sorted gram keys, offsets and name ids)
+    save() writes the arrays as .npy files that open() memory-maps read-only, so every
+    worker process shares the same pages instead of unpickling its own copy.
+    """
+    def __init__(self, arrays, groups, path=None):
+        self.path = path
+        self.groups = {group: i for i, group in enumerate(groups)}
+        for name in INDEX_ARRAYS:
+            setattr(self, name, arrays[name])
+        self._matchers = {}
+
+    @classmethod
+    def build(cls, names_by_group, ngrams=True):
+        """
+        Builds an in-memory index from {group: {name: value}}. Values are stored as strings.
+        With ngrams=False only exact lookups are indexed (no fuzzy candidates).
+        """
+        groups = sorted(group for group, choices in names_by_group.items() if choices)
+        group_bounds, name_offsets, blob, values = [0], [0], bytearray(), []
+        gram_keys, gram_ids, gram_counts = array('q'), array('i'), array('i')
+        for group_id, group in enumerate(groups):
+            # Scored strings are preprocessed once here instead of on every comparison
+            processed = {}
+            for name, value in names_by_group[group].items():
+                key = utils.default_process(name).encode('utf-8')
+                if key:
+                    processed[key] = value
+            for key in sorted(processed):
+                name_id = len(values)
+                blob += key
+                name_offsets.append(len(blob))
+                values.append(str(processed[key]).encode('utf-8'))
+                if not ngrams:
+                    gram_counts.append(0)
+                    continue
+                grams = _ngrams(key.decode('utf-8'))
+                gram_counts.append(len(grams))
+                gram_keys.extend(_gram_key(group_id, gram) for gram in grams)
+                gram_ids.extend([name_id] * len(grams))
+            group_bounds.append(len(values))
+
+        gram_keys = np.frombuffer(gram_keys, dtype=np.int64)
+        order = np.argsort(gram_keys, kind='stable') # stable keeps each posting list in name order
+        unique_keys, starts = np.unique(gram_keys[order], return_index=True)
+        arrays = {
+            'group_bounds': np.array(group_bounds, dtype=np.int64),
+            'name_offsets': np.array(name_offsets, dtype=np.int64),
+            'name_blob': np.frombuffer(bytes(blob), dtype=np.uint8),
+            'values': np.array(values, dtype=bytes) if values else np.empty(0, dtype='S1'),
+            'gram_counts': np.frombuffer(gram_counts, dtype=np.int32).copy(),
+            'gram_keys': unique_keys,
+            'gram_offsets': np.append(starts, len(order)).astype(np.int64),
+            'gram_ids': np.frombuffer(gram_ids, dtype=np.int32)[order],
+        }
+        return cls(arrays, groups)
+
+    def save(self, path):
+        """Writes the index to directory `path`, replacing any previous index there."""
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(tmp_path, name + '.npy'), getattr(self, name))
+        with open(os.path.join(tmp_path, 'header.json'), 'w') as f:
+            json.dump({'format_version': INDEX_FORMAT_VERSION, 'ngram_size': NGRAM_SIZE,
+                       'groups': list(self.groups), 'count': len(self.values)}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        self.path = path
+
+    @classmethod
+    def open(cls, path):
+        """Memory-maps an index written by save()."""
+        with open(os.path.join(path, 'header.json')) as f:
+            header = json.load(f)
+        if header['format_version'] != INDEX_FORMAT_VERSION or header['ngram_size'] != NGRAM_SIZE:
+            raise ValueError(f"Name index at {path} was written by an incompatible version; rebuild it.")
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in INDEX_ARRAYS}
+        return cls(arrays, header['groups'], path)
+
+    def __len__(self):
+        return len(self.values)
+
+    def name_bytes(self, name_id):
+        return self.name_blob[self.name_offsets[name_id]:self.name_offsets[name_id + 1]].tobytes()
+
+    def matcher(self, group, max_candidates=MAX_CANDIDATES):
+        """The BlockedMatcher for one group, or None if the group has no names."""
+        group_id = self.groups.get(group)
+        if group_id is None:
+            return None
+        key = (group_id, max_candidates)
+        if key not in self._matchers:
+            self._matchers[key] = BlockedMatcher(max_candidates=max_candidates, index=self, group_id=group_id)
+        return self._matchers[key]
+
+class BlockedMatcher:
+    """
+    Fuzzy lookup over a fixed set of names. A character n-gram inverted index picks the
+    names with the best n-gram overlap with a query, and only those are scored with
+    rapidfuzz's WRatio, the same scorer fuzzywuzzy's process.extractOne defaults to.
+
+    Either pass `choices` ({name: value}) or a NameIndex and group. Matches are returned
+    as (indexed name, value, score); the indexed name is the preprocessed form.
+    """
+    def __init__(self, choices=None, max_candidates=MAX_CANDIDATES, index=None, group_id=0):
+        if index is None:
+            index = NameIndex.build({'': choices or {}})
+        self.index = index
+        self.group_id = group_id
+        self.max_candidates = max_candidates
+        if group_id + 1 < len(index.group_bounds):
+            self._lo, self._hi = int(index.group_bounds[group_id]), int(index.group_bounds[group_id + 1])
+        else:
+            self._lo = self._hi = 0 # built from empty choices
+        self._names = _GroupNames(index, self._lo, self._hi)
+        self._common_limit = max(MIN_COMMON_GRAM_POSTINGS, int((self._hi - self._lo) * COMMON_GRAM_FRACTION))
+
+    def __len__(self):
+        return self._hi - self._lo
+
+    def names(self):
+        """The indexed (preprocessed) names, in index order."""
+        return [self.index.name_bytes(i).decode('utf-8') for i in range(self._lo, self._hi)]
+
+    def _result(self, name_id, score):
+        return self.index.name_bytes(name_id).decode('utf-8'), self.index.values[name_id].decode('utf-8'), score
+
+    def _exact(self, processed_query):
+        key = processed_query.encode('utf-8')
+        i = bisect_left(self._names, key)
+        if i < len(self._names) and self._names[i] == key:
+            return self._lo + i
+        return None
+
+    def candidates(self, processed_query):
+        """Name ids most similar to an already-processed query by n-gram overlap."""
+        index = self.index
+        grams = _ngrams(processed_query)
+        keys = np.array([_gram_key(self.group_id, gram) for gram in grams], dtype=np.int64)
+        positions = np.searchsorted(index.gram_keys, keys)
+        in_range = positions < len(index.gram_keys)
+        positions, keys = positions[in_range], keys[in_range]
+        positions = positions[index.gram_keys[positions] == keys]
+        if not len(positions):
+            return np.empty(0, dtype=np.int64)
+
+        starts, ends = index.gram_offsets[positions], index.gram_offsets[positions + 1]
+        selective = (ends - starts) <= self._common_limit
+        if 2 * selective.sum() >= len(positions):
+            starts, ends = starts[selective], ends[selective]
+        shared = np.bincount(np.concatenate([index.gram_ids[s:e] for s, e in zip(starts, ends)]) - self._lo)
+        ids = np.flatnonzero(shared)
+        shared = shared[ids]
+        ids += self._lo
+        if len(ids) > self.max_candidates:
+            # Two shortlists, merged. Dice overlap favours names of about the query's length.
+            # The overlap coefficient (shared grams / the smaller gram set) keeps names that
+            # contain the query or are contained in it, which WRatio's partial and token-set
+            # ratios score highly but Dice ranks low; ties go to the shorter name.
+            counts = index.gram_counts[ids]
+            dice = shared / (len(grams) + counts)
+            containment = shared / np.maximum(np.minimum(len(grams), counts), 1) - 1e-6 * counts
+            ids = ids[np.union1d(_top(dice, self.max_candidates), _top(containment, self.max_candidates))]
+        return ids
+
+    def _match_processed(self, processed_query, score_cutoff):
+        if not processed_query or not len(self):
+            return None
+        exact = self._exact(processed_query)
+        if exact is not None:
+            return self._result(exact, 100.0)
+        ids = self.candidates(processed_query)
+        if not len(ids):
+            return None
+        choices = [self.index.name_bytes(i).decode('utf-8') for i in ids]
+        best = process.extractOne(processed_query, choices, scorer=fuzz.WRatio, processor=None, score_cutoff=score_cutoff)
+        if best is None:
+            return None
+        return self._result(ids[best[2]], best[1])
+
+    def lookup(self, query):
+        """Exact lookup only: (name, value, 100.0) if the preprocessed query is indexed, else None."""
+        processed_query = utils.default_process(query) if query else ''
+        exact = self._exact(processed_query) if processed_query and len(self) else None
+        return self._result(exact, 100.0) if exact is not None else None
+
+    def match(self, query, score_cutoff=0):
+        """Returns (name, value, score) for the best match scoring at least `score_cutoff`, or None."""
+        return self._match_processed(utils.default_process(query) if query else '', score_cutoff)
+
+    def match_many(self, queries, score_cutoff=0):
+        """
+        Batch form of match(): one result (or None) per query, in order. Repeated names,
+        common among grant recipients, are only scored once.
+        """
+        results = {}
+        matches = []
+        for query in queries:
+            key = utils.default_process(query) if query else ''
+            if key not in results:
+                results[key] = self._match_processed(key, score_cutoff)
+            matches.append(results[key])
+        return matches
+
+def build_matchers(names_by_group, max_candidates=MAX_CANDIDATES):
+    """Builds one BlockedMatcher per group (e.g. per state) from {group: {name: value}}."""
+    index = NameIndex.build(names_by_group)
+    return {group: index.matcher(group, max_candidates) for group in index.groups}
@@ -5,14 +5,63 @@ load_dotenv()
 
 import os
 import psycopg2
-from psycopg2.extras import RealDictCursor, execute_batch
-from sentence_transformers import SentenceTransformer
+from psycopg2.extras import RealDictCursor
 from pgvector.psycopg2 import register_vector
 from tqdm import tqdm
 import numpy as np
 
+from embedding_store import write_embedding_store, load_embedding_store, EMBEDDING_STORE_PATH
+from ann_index import build_ann_index
+from db_stream import stream_rows, count_rows
+from embedding_pipeline import embed_pending_grants
+from embedding_encoder import EncoderPool, ENCODER_BACKEND, encoder_cache_name
+
 # --- CONFIGURATION ---
 MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_DIM = 384
+STORE_DTYPE = os.environ.get("EMBEDDING_STORE_DTYPE", "float32") # 'float16' halves the file size
+
+def stored_encoder(conn):
+    """
+    The one encoder behind every stored grant embedding. Raises if the table mixes encoders
+    (a backend switch that hasn't finished re-embedding) or holds vectors of unknown origin.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT embedding_model, COUNT(*) AS grants FROM grants WHERE embedding IS NOT NULL GROUP BY embedding_model")
+        encoders = {row['embedding_model']: row['grants'] for row in cursor.fetchall()}
+    if not encoders:
+        return encoder_cache_name(MODEL_NAME)
+    if len(encoders) > 1 or None in encoders:
+        found = ", ".join(f"{name or 'unknown'}: {count:,}" for name, count in encoders.items())
+        raise ValueError(f"Grant embeddings come from more than one encoder ({found}); "
+                         f"run generate_embeddings.py with a single ENCODER_BACKEND to finish re-embedding.")
+    return next(iter(encoders))
+
+def export_embedding_store(conn):
+    """Publishes every stored grant embedding to the memory-mapped store the API serves from."""
+    encoder = stored_encoder(conn)
+    print(f"Exporting '{encoder}' embeddings to '{EMBEDDING_STORE_PATH}'...")
+    query = "SELECT id, embedding FROM grants WHERE embedding IS NOT NULL AND embedding_model = %s ORDER BY id"
+    count = count_rows(conn, query, (encoder,))
+    # Vectors are copied straight into preallocated arrays as they stream in
+    grant_ids = np.empty(count, dtype=np.int64)
+    embeddings = np.empty((count, EMBEDDING_DIM), dtype=np.float32)
+    filled = 0
+    for grant_id, embedding in tqdm(stream_rows(conn, query, (encoder,), row_type='tuple'), total=count, desc="Exporting Embeddings"):
+        if filled == count:
+            break # rows added after the count are picked up by the next export
+        grant_ids[filled] = grant_id
+        embeddings[filled] = embedding
+        filled += 1
+    grant_ids, embeddings = grant_ids[:filled], embeddings[:filled]
+
+    header = write_embedding_store(EMBEDDING_STORE_PATH, grant_ids, embeddings, MODEL_NAME, dtype=STORE_DTYPE, encoder=encoder)
+    print(f"Embedding store written: {header['count']} vectors from '{encoder}', {header['dim']} dims, {header['dtype']}, "
+          f"checksum {header['checksum'][:12]}.")
+
+    print("Building the ANN index for the new store...")
+    backend = build_ann_index(load_embedding_store(EMBEDDING_STORE_PATH))
+    print(f"ANN index built with the '{backend}' backend.")
 
 def main():
     print("--- Starting Final Embedding Generation ---")
@@ -25,37 +74,19 @@ def main():
         conn = psycopg2.connect(db_url, cursor_factory=RealDictCursor)
         register_vector(conn) # Enable the pgvector type for this connection
 
-        print(f"Loading AI model: '{MODEL_NAME}'... (This may take a moment)")
-        model = SentenceTransformer(MODEL_NAME)
-        print("Model loaded successfully.")
-
-        with conn.cursor() as cursor:
+        print(f"Starting encoder workers for '{MODEL_NAME}' ({ENCODER_BACKEND})... (This may take a moment)")
+        with EncoderPool(MODEL_NAME) as encoder:
+            print(f"{encoder.processes} workers x {encoder.threads} threads.")
             print("Finding all grants that need embeddings...")
-            cursor.execute("SELECT id, grant_purpose FROM grants WHERE grant_purpose IS NOT NULL AND embedding IS NULL")
-            all_rows = cursor.fetchall()
-
-        if not all_rows:
+            stats = embed_pending_grants(conn, encoder, encoder.cache_name)
+        if not stats['rows']:
             print("All grant embeddings are already up to date.")
-            return
-
-        print(f"Found {len(all_rows)} grants to embed. Processing...")
-        
-        grant_texts = [row['grant_purpose'] for row in all_rows]
-        
-        # Generate all embeddings at once for maximum efficiency
-        embeddings = model.encode(grant_texts, show_progress_bar=True)
-        
-        updates_to_make = []
-        for i, row in enumerate(all_rows):
-            updates_to_make.append((np.array(embeddings[i]), row['id']))
-
-        print(f"Embeddings generated. Updating {len(updates_to_make)} records in the database...")
-        
-        with conn.cursor() as cursor:
-            execute_batch(cursor, "UPDATE grants SET embedding = %s WHERE id = %s", updates_to_make)
-            conn.commit()
+        else:
+            print(f"\n--- Success! {stats['rows']} grant embeddings are now stored in the database "
+                  f"({stats['rows_per_second']:,.0f} grants/s). ---")
 
-        print(f"\n--- Success! {cursor.rowcount} grant embeddings are now stored in the database. ---")
+        # Always republish, so the API store matches the database even when nothing new was embedded.
+        export_embedding_store(conn)
 
     except Exception as e:
         print(f"\nAn error occurred: {e}")
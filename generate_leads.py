@@ -3,6 +3,8 @@ import psycopg2
 from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
+from db_stream import stream_rows
+
 # Load database credentials from .env file
 load_dotenv()
 
@@ -27,24 +29,15 @@ def main():
             existing_eins = {row[0] for row in cur.fetchall()}
             print(f"Found {len(existing_eins)} existing leads in the CRM.")
 
-            # 2. Get all potential leads from your main charities table
-            # THIS QUERY HAS BEEN CORRECTED
-            cur.execute("""
+            # 2. Stream all potential leads from your main charities table
+            # 3. Keep only the charities that don't already exist
+            potential_leads = stream_rows(conn, """
                 SELECT DISTINCT ON (ein)
                     ein, name, city, state
                 FROM charities
-                WHERE ein IS NOT NULL;
-            """)
-            potential_leads_cursor = cur.fetchall()
-            potential_leads = [(lead[0], lead[1], lead[2], lead[3]) for lead in potential_leads_cursor]
-
-
-            # 3. Filter out the charities that already exist
-            new_leads_to_insert = []
-            for lead in potential_leads:
-                ein = lead[0]
-                if ein not in existing_eins:
-                    new_leads_to_insert.append(lead)
+                WHERE ein IS NOT NULL
+            """, row_type='tuple')
+            new_leads_to_insert = [lead for lead in potential_leads if lead[0] not in existing_eins]
 
             if not new_leads_to_insert:
                 print("No new leads found to insert.")
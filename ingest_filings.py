@@ -0,0 +1,160 @@
+# ingest_filings.py (Unified One-Pass 990 Ingestion: Foundations, Grants and Charities)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import sys
+from multiprocessing import Pool
+import psycopg2
+from tqdm import tqdm
+
+from irs990_extractor import extract_filing
+from bulk_loader import bulk_insert, bulk_update
+from parse_charities import convert_windows_path_to_wsl
+
+# --- CONFIGURATION ---
+# Both corpora, loaded together: the tables are emptied once, before any of them is read, so
+# the foundation 990-PFs (foundations, grants) and the charity 990s (charity profiles and
+# financials) never wipe each other's rows. Pass other lists as arguments to replace these.
+FILE_LIST_PATHS = ("file_list.txt", "charity_file_list.txt")
+NUM_PROCESSES = 6
+FLUSH_EVERY_FILES = 2000 # write buffered records after this many filings
+
+class RecordSink:
+    """Buffers one record type and loads it with COPY plus a single merge statement per flush."""
+    def __init__(self, table, columns, key_columns=None, on_conflict="ON CONFLICT DO NOTHING"):
+        self.table = table
+        self.columns = columns
+        self.key_columns = key_columns # set for sinks that UPDATE existing rows instead of inserting
+        self.on_conflict = on_conflict
+        self.buffer = []
+        self.written = 0
+        self.seconds = 0.0
+
+    def add(self, record):
+        self.buffer.append(record)
+
+    def flush(self, cursor):
+        if not self.buffer:
+            return
+        if self.key_columns:
+            update_columns = [c for c in self.columns if c not in self.key_columns]
+            stats = bulk_update(cursor, self.table, self.key_columns, update_columns, self.buffer, report=False)
+        else:
+            stats = bulk_insert(cursor, self.table, self.columns, self.buffer, on_conflict=self.on_conflict, report=False)
+        self.written += stats['rows']
+        self.seconds += stats['seconds']
+        self.buffer = []
+
+def build_sinks():
+    # Order matters: grants reference foundations, so foundations are flushed first.
+    return {
+        'foundations': RecordSink('foundations',
+            ['ein', 'name', 'address_line_1', 'city', 'state', 'zip_code', 'assets_fmv', 'mission_statement'],
+            on_conflict="ON CONFLICT (ein) DO NOTHING"),
+        'grants': RecordSink('grants',
+            ['foundation_ein', 'tax_year', 'recipient_name', 'grant_amount', 'grant_purpose', 'recipient_ein']),
+        'charity_profiles': RecordSink('charities',
+            ['ein', 'mission_statement', 'address_line_1', 'zip_code'], key_columns=['ein']),
+        'charity_financials': RecordSink('charity_financials',
+            ['ein', 'tax_year', 'total_revenue', 'total_expenses'],
+            on_conflict="ON CONFLICT (ein, tax_year) DO NOTHING"),
+    }
+
+def route_filing(filing, sinks):
+    """
+    Sends every record type found in one filing to its sink, applying the same rules
+    as populate_foundations.py, local_parser.py and parse_charities.py.
+    """
+    filer = filing['filer']
+    if filer['name']:
+        sinks['foundations'].add({
+            'ein': filer['ein'], 'name': filer['name'],
+            'address_line_1': filer['address_line_1'], 'city': filer['city'],
+            'state': filer['state'], 'zip_code': filer['zip_code'],
+            'assets_fmv': filer['assets_fmv'],
+            'mission_statement': filer['activity_or_mission_desc'] or filer['mission_desc']
+        })
+        # Without a foundation row the grants would violate the foreign key
+        for grant in filing['grants']:
+            sinks['grants'].add(grant)
+
+    charity_mission = filer['mission_desc'] or filer['activity_or_mission_desc']
+    if charity_mission:
+        sinks['charity_profiles'].add({
+            'ein': filer['ein'], 'mission_statement': charity_mission,
+            'address_line_1': filer['address_line_1'], 'zip_code': filer['zip_code']
+        })
+    if filing['financials']:
+        sinks['charity_financials'].add(filing['financials'])
+
+def flush_sinks(conn, sinks):
+    with conn.cursor() as cursor:
+        for sink in sinks.values():
+            sink.flush(cursor)
+    conn.commit()
+
+def read_file_lists(paths):
+    """Every filing path in the given lists, in order, each once; None if a list is missing."""
+    files = {}
+    for path in paths:
+        try:
+            with open(path, 'r') as f:
+                files.update((convert_windows_path_to_wsl(line), None) for line in f if line.strip())
+        except FileNotFoundError:
+            print(f"ERROR: The file list '{path}' was not found.")
+            return None
+    return list(files)
+
+def main():
+    print("--- Starting Unified 990 Ingestion (one pass per filing) ---")
+    db_dsn = os.environ.get("DATABASE_URL")
+    if not db_dsn:
+        raise ValueError("DATABASE_URL not found in .env file.")
+
+    file_list_paths = sys.argv[1:] or FILE_LIST_PATHS
+    files_to_process = read_file_lists(file_list_paths)
+    if files_to_process is None:
+        return
+    if not files_to_process:
+        print("The file list is empty. No files to process.")
+        return
+
+    conn = psycopg2.connect(db_dsn)
+    try:
+        with conn.cursor() as cursor:
+            # Every table the sinks fill is reloaded from the lists above, and only here
+            print("Cleaning foundations, grants and charity_financials before import...")
+            # CASCADE also clears grants, which reference foundations
+            cursor.execute("TRUNCATE foundations RESTART IDENTITY CASCADE;")
+            cursor.execute("TRUNCATE grants RESTART IDENTITY;")
+            cursor.execute("TRUNCATE charity_financials RESTART IDENTITY;")
+        conn.commit()
+
+        sinks = build_sinks()
+        parsed_count = 0
+        print(f"Found {len(files_to_process)} files to ingest from {', '.join(file_list_paths)}...")
+        with Pool(processes=NUM_PROCESSES) as pool:
+            filings = pool.imap_unordered(extract_filing, files_to_process, chunksize=16)
+            for i, filing in enumerate(tqdm(filings, total=len(files_to_process), desc="Ingesting Filings"), start=1):
+                if filing:
+                    parsed_count += 1
+                    route_filing(filing, sinks)
+                if i % FLUSH_EVERY_FILES == 0:
+                    flush_sinks(conn, sinks)
+        flush_sinks(conn, sinks)
+
+        print(f"\n--- Ingestion complete ---")
+        print(f"Successfully parsed: {parsed_count}/{len(files_to_process)}")
+        for name, sink in sinks.items():
+            rate = sink.written / sink.seconds if sink.seconds else 0
+            print(f"  {name}: {sink.written:,} records loaded ({rate:,.0f} rows/s)")
+    except Exception as e:
+        print(f"Database update failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,103 @@ load_dotenv()
 import os
 import psycopg2
 
+# The foundation score change log and its triggers (see precompute_scores.py). Installed here
+# only: replacing a trigger locks its table exclusively, so scoring runs just check for them.
+SCORE_CHANGE_LOG_TRIGGERS = {
+    'grants': ('grants_score_changes_insert', 'grants_score_changes_update',
+               'grants_score_changes_delete', 'grants_score_changes_truncate'),
+    'charities': ('charities_score_changes_truncate',),
+    'foundations': ('foundations_score_changes', 'foundations_score_changes_truncate'),
+}
+SCORE_CHANGE_LOG_SCHEMA = """
+    -- Foundation score change log: triggers record each foundation whose scores may have moved,
+    -- for precompute_scores.py --incremental. A NULL foundation_ein means "everything" (a table
+    -- was truncated, or the log is new and earlier changes were never recorded): a full rebuild.
+    DO $$
+    BEGIN
+        IF to_regclass('foundation_score_changes') IS NULL THEN
+            CREATE TABLE foundation_score_changes (
+                id BIGSERIAL PRIMARY KEY,
+                foundation_ein TEXT,
+                changed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+            INSERT INTO foundation_score_changes (foundation_ein) VALUES (NULL);
+        END IF;
+    END $$;
+
+    -- Scoring one foundation's grants, and cascading foundation deletes, look grants up by foundation
+    CREATE INDEX IF NOT EXISTS grants_foundation_ein_idx ON grants (foundation_ein);
+
+    -- Statement-level, over transition tables: a bulk load or delete logs each foundation once
+    CREATE OR REPLACE FUNCTION log_grant_score_changes() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            INSERT INTO foundation_score_changes (foundation_ein) VALUES (NULL);
+        ELSIF TG_OP = 'INSERT' THEN
+            INSERT INTO foundation_score_changes (foundation_ein)
+            SELECT DISTINCT foundation_ein FROM new_rows WHERE foundation_ein IS NOT NULL;
+        ELSE
+            INSERT INTO foundation_score_changes (foundation_ein)
+            SELECT DISTINCT foundation_ein FROM old_rows WHERE foundation_ein IS NOT NULL;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- Row-level, and only for rows whose scored columns changed: bulk updates of embeddings,
+    -- normalized names or match bookkeeping never reach it
+    CREATE OR REPLACE FUNCTION log_grant_score_update() RETURNS trigger AS $$
+    BEGIN
+        IF OLD.foundation_ein IS NOT NULL THEN
+            INSERT INTO foundation_score_changes (foundation_ein) VALUES (OLD.foundation_ein);
+        END IF;
+        IF NEW.foundation_ein IS NOT NULL AND NEW.foundation_ein IS DISTINCT FROM OLD.foundation_ein THEN
+            INSERT INTO foundation_score_changes (foundation_ein) VALUES (NEW.foundation_ein);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION log_foundation_score_changes() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO foundation_score_changes (foundation_ein)
+        VALUES (CASE WHEN TG_OP = 'DELETE' THEN OLD.ein ELSE NEW.ein END);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS grants_score_changes_insert ON grants;
+    CREATE TRIGGER grants_score_changes_insert AFTER INSERT ON grants
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_grant_score_changes();
+    DROP TRIGGER IF EXISTS grants_score_changes_update ON grants;
+    CREATE TRIGGER grants_score_changes_update
+        AFTER UPDATE OF foundation_ein, recipient_ein_matched, grant_amount, tax_year ON grants
+        FOR EACH ROW
+        WHEN (OLD.foundation_ein IS DISTINCT FROM NEW.foundation_ein
+              OR OLD.recipient_ein_matched IS DISTINCT FROM NEW.recipient_ein_matched
+              OR OLD.grant_amount IS DISTINCT FROM NEW.grant_amount
+              OR OLD.tax_year IS DISTINCT FROM NEW.tax_year)
+        EXECUTE FUNCTION log_grant_score_update();
+    DROP TRIGGER IF EXISTS grants_score_changes_delete ON grants;
+    CREATE TRIGGER grants_score_changes_delete AFTER DELETE ON grants
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION log_grant_score_changes();
+    DROP TRIGGER IF EXISTS grants_score_changes_truncate ON grants;
+    CREATE TRIGGER grants_score_changes_truncate AFTER TRUNCATE ON grants
+        FOR EACH STATEMENT EXECUTE FUNCTION log_grant_score_changes();
+
+    -- A charities reload can move recipient states, so it also forces a full rebuild
+    DROP TRIGGER IF EXISTS charities_score_changes_truncate ON charities;
+    CREATE TRIGGER charities_score_changes_truncate AFTER TRUNCATE ON charities
+        FOR EACH STATEMENT EXECUTE FUNCTION log_grant_score_changes();
+
+    DROP TRIGGER IF EXISTS foundations_score_changes ON foundations;
+    CREATE TRIGGER foundations_score_changes AFTER INSERT OR DELETE OR UPDATE OF assets_fmv ON foundations
+        FOR EACH ROW EXECUTE FUNCTION log_foundation_score_changes();
+    DROP TRIGGER IF EXISTS foundations_score_changes_truncate ON foundations;
+    CREATE TRIGGER foundations_score_changes_truncate AFTER TRUNCATE ON foundations
+        FOR EACH STATEMENT EXECUTE FUNCTION log_grant_score_changes();
+"""
+
 def main():
     conn = None
     try:
@@ -51,7 +148,8 @@ def main():
                     address_line_1 TEXT,
                     zip_code TEXT,
                     mission_statement TEXT,
-                    normalized_name TEXT
+                    normalized_name TEXT,
+                    normalized_name_version TEXT
                 );
 
                 CREATE TABLE IF NOT EXISTS charity_profiles (
@@ -72,10 +170,47 @@ def main():
                     recipient_ein TEXT,
                     recipient_ein_matched TEXT,
                     normalized_name TEXT,
-                    embedding public.vector(384)
+                    normalized_name_version TEXT,
+                    match_attempts JSONB,
+                    match_method TEXT,
+                    match_score REAL,
+                    embedding public.vector(384),
+                    embedding_model TEXT
+                );
+
+                CREATE TABLE IF NOT EXISTS enrichment_runs (
+                    run_name TEXT PRIMARY KEY,
+                    matcher_version TEXT NOT NULL,
+                    score_cutoff INTEGER,
+                    last_grant_id INTEGER NOT NULL DEFAULT 0,
+                    grants_attempted BIGINT NOT NULL DEFAULT 0,
+                    grants_matched BIGINT NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    started_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                );
+
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    text_hash TEXT PRIMARY KEY,
+                    model_name TEXT NOT NULL,
+                    embedding public.vector(384) NOT NULL,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                );
+
+                CREATE TABLE IF NOT EXISTS purpose_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    prompt_version TEXT NOT NULL,
+                    model_name TEXT NOT NULL,
+                    foundation_ein TEXT NOT NULL,
+                    recipient_ein TEXT NOT NULL,
+                    purpose TEXT NOT NULL,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
                 );
+                CREATE INDEX IF NOT EXISTS purpose_cache_pair_idx ON purpose_cache (foundation_ein, recipient_ein);
             """
             cursor.execute(create_script)
+            print("Creating the foundation score change log and its triggers...")
+            cursor.execute(SCORE_CHANGE_LOG_SCHEMA)
             conn.commit()
 
         print("--- Database Initialization Complete ---")
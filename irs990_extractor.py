@@ -0,0 +1,126 @@
+# irs990_extractor.py (Streaming, Single-Pass 990 / 990-PF XML Extraction)
+
+import xml.etree.ElementTree as ET
+
+# Grant group elements and the fields captured inside each one (first match wins, like find('.//...')).
+# 990-PF:           GrantOrContributionPdDurYrGrp
+# 990 Schedule I:   IRS990ScheduleI/RecipientTable
+PF_GRANT_TAG = 'GrantOrContributionPdDurYrGrp'
+SCHEDULE_I_GRANT_TAG = 'RecipientTable'
+GRANT_FIELDS = {
+    PF_GRANT_TAG: {'Amt': 'grant_amount', 'GrantOrContributionPurposeTxt': 'grant_purpose'},
+    SCHEDULE_I_GRANT_TAG: {'CashGrantAmt': 'grant_amount', 'PurposeOfGrantTxt': 'grant_purpose', 'RecipientEIN': 'recipient_ein'},
+}
+FILER_ADDRESS_FIELDS = {'AddressLine1Txt': 'address_line_1', 'CityNm': 'city', 'StateAbbreviationCd': 'state', 'ZIPCd': 'zip_code'}
+# Return-level fields, captured at their first occurrence anywhere in the filing
+DOCUMENT_FIELDS = {
+    'TaxYr': 'tax_year',
+    'ActivityOrMissionDesc': 'activity_or_mission_desc',
+    'MissionDesc': 'mission_desc',
+    'CYTotalRevenueAmt': 'total_revenue',
+    'CYTotalExpensesAmt': 'total_expenses',
+    'FMVAssetsEOYAmt': 'assets_fmv',
+}
+
+def _local_name(tag):
+    """Drops the '{namespace}' prefix, so namespaced and bare filings read the same."""
+    return tag.rsplit('}', 1)[-1]
+
+def _to_int(value):
+    try:
+        return int(value) if value else None
+    except (ValueError, TypeError):
+        return None
+
+def extract_filing(filepath):
+    """
+    Reads one 990 or 990-PF filing with iterparse in a single pass and returns
+        {'filer': {...}, 'grants': [...], 'financials': {...} or None}
+    or None if the file can't be parsed or has no filer EIN.
+
+    Each element is detached from its parent as soon as its end tag has been handled,
+    so memory stays flat no matter how many grants a filing lists.
+    """
+    filer = {'ein': None, 'name': None, 'address_line_1': None, 'city': None, 'state': None, 'zip_code': None}
+    document = {}
+    grants = []
+    path = [] # local names of the open elements
+    elements = [] # the open elements themselves, for detaching finished children
+    grant = None # fields of the grant group currently open
+    grant_depth = None
+
+    try:
+        for event, elem in ET.iterparse(filepath, events=('start', 'end')):
+            if event == 'start':
+                name = _local_name(elem.tag)
+                path.append(name)
+                elements.append(elem)
+                if grant is None and (name == PF_GRANT_TAG or (name == SCHEDULE_I_GRANT_TAG and 'IRS990ScheduleI' in path)):
+                    grant, grant_depth = {'type': name}, len(path)
+                continue
+
+            name = path[-1]
+            text = elem.text.strip() if elem.text else None
+            if text:
+                if grant is not None:
+                    field = GRANT_FIELDS[grant['type']].get(name)
+                    if name == 'BusinessNameLine1Txt' and path[-2] == 'RecipientBusinessName':
+                        field = 'recipient_name'
+                    if field and field not in grant:
+                        grant[field] = text
+                if len(path) >= 2 and path[-2] == 'Filer':
+                    if name == 'EIN' and filer['ein'] is None:
+                        filer['ein'] = text
+                elif len(path) >= 3 and path[-3] == 'Filer':
+                    if path[-2] == 'BusinessName' and name == 'BusinessNameLine1Txt' and filer['name'] is None:
+                        filer['name'] = text
+                    elif path[-2] == 'USAddress' and name in FILER_ADDRESS_FIELDS and filer[FILER_ADDRESS_FIELDS[name]] is None:
+                        filer[FILER_ADDRESS_FIELDS[name]] = text
+                if name in DOCUMENT_FIELDS and DOCUMENT_FIELDS[name] not in document:
+                    document[DOCUMENT_FIELDS[name]] = text
+
+            if grant is not None and len(path) == grant_depth:
+                grants.append(grant)
+                grant, grant_depth = None, None
+
+            path.pop()
+            elements.pop()
+            elem.clear()
+            if elements:
+                elements[-1].remove(elem) # each finished sibling is removed, so this is always O(1)
+    except (ET.ParseError, FileNotFoundError, OSError):
+        return None
+
+    if not filer['ein']:
+        return None
+
+    ein = filer['ein']
+    tax_year = _to_int(document.get('tax_year'))
+    filer.update(
+        tax_year=tax_year,
+        activity_or_mission_desc=document.get('activity_or_mission_desc'),
+        mission_desc=document.get('mission_desc'),
+        assets_fmv=_to_int(document.get('assets_fmv')),
+    )
+
+    grant_records = []
+    for grant in grants:
+        amount = _to_int(grant.get('grant_amount'))
+        if not grant.get('recipient_name') or amount is None:
+            continue
+        grant_records.append({
+            'foundation_ein': ein, 'tax_year': tax_year,
+            'recipient_name': grant['recipient_name'], 'grant_amount': amount,
+            'grant_purpose': grant.get('grant_purpose'),
+            'recipient_ein': grant.get('recipient_ein') # PF forms do not have recipient EIN
+        })
+
+    financials = None
+    revenue, expenses = document.get('total_revenue'), document.get('total_expenses')
+    if tax_year and (revenue or expenses):
+        total_revenue, total_expenses = _to_int(revenue), _to_int(expenses)
+        # Mirrors the old parser: a value that isn't a valid number drops the record
+        if (revenue is None or total_revenue is not None) and (expenses is None or total_expenses is not None):
+            financials = {'ein': ein, 'tax_year': tax_year, 'total_revenue': total_revenue, 'total_expenses': total_expenses}
+
+    return {'filer': filer, 'grants': grant_records, 'financials': financials}
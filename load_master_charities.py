@@ -6,12 +6,13 @@ load_dotenv()
 import os
 import csv
 import psycopg2
-from psycopg2.extras import execute_batch
 from tqdm import tqdm
 
+from bulk_loader import bulk_insert
+
 # --- CONFIGURATION ---
 MASTER_CHARITIES_CSV = "master_charities.csv"
-BATCH_SIZE = 5000
+CHARITY_COLUMNS = ['ein', 'name', 'city', 'state', 'address_line_1', 'zip_code']
 
 # --- DATABASE CONNECTION ---
 def get_db_connection():
@@ -22,7 +23,7 @@ def get_db_connection():
 
 def main():
     """
-    Reads the master charity CSV and performs a bulk insert into the 'charities' table.
+    Streams the master charity CSV into the 'charities' table with COPY.
     """
     print("--- Starting Master Charity List Import ---")
     
@@ -39,9 +40,8 @@ def main():
         cursor.execute("TRUNCATE charities RESTART IDENTITY;")
         conn.commit()
 
-        print(f"Reading '{MASTER_CHARITIES_CSV}' and preparing data for insert...")
+        print(f"Streaming '{MASTER_CHARITIES_CSV}' into the database...")
         
-        charities_to_insert = []
         with open(MASTER_CHARITIES_CSV, 'r', encoding='utf-8') as f:
             reader = csv.DictReader(f)
             
@@ -59,46 +59,20 @@ def main():
                 print(f"Found: {headers}")
                 return
 
-            for i, row in enumerate(reader):
-                try:
-                    # We only map the columns that exist in the CSV.
-                    # The database table allows address_line_1 and zip_code to be empty (NULL).
-                    charities_to_insert.append({
-                        'ein': row['ein'],
-                        'name': row['name'],
-                        'city': row['city'],
-                        'state': row['state'],
-                        'address_line_1': None, # Set to None as it's not in the CSV
-                        'zip_code': None       # Set to None as it's not in the CSV
-                    })
-                except KeyError as e:
-                    print(f"\n--- ERROR ---")
-                    print(f"A required column is missing from the CSV file: {e}")
-                    print(f"This error occurred on row number: {i + 2}")
-                    print(f"The available columns in this row are: {list(row.keys())}")
-                    return
-
-        if not charities_to_insert:
+            # Rows go straight from the CSV reader into COPY; the file is never held in memory.
+            # address_line_1 and zip_code are not in the CSV, so they are loaded as NULL.
+            rows = (
+                (row['ein'], row['name'], row['city'], row['state'], None, None)
+                for row in tqdm(reader, desc="Loading Charities", unit=" rows")
+            )
+            stats = bulk_insert(cursor, 'charities', CHARITY_COLUMNS, rows, on_conflict="ON CONFLICT (ein) DO NOTHING")
+
+        if not stats['rows']:
             print("No charities found in the CSV file.")
             return
 
-        print(f"Found {len(charities_to_insert)} charities. Starting bulk insert...")
-
-        with tqdm(total=len(charities_to_insert), desc="Inserting Charities") as pbar:
-            execute_batch(
-                cursor,
-                """
-                INSERT INTO charities (ein, name, city, state, address_line_1, zip_code)
-                VALUES (%(ein)s, %(name)s, %(city)s, %(state)s, %(address_line_1)s, %(zip_code)s)
-                ON CONFLICT (ein) DO NOTHING;
-                """,
-                charities_to_insert,
-                page_size=BATCH_SIZE
-            )
-            pbar.update(len(charities_to_insert))
-        
         conn.commit()
-        print(f"\nSuccessfully inserted {cursor.rowcount if cursor.rowcount > 0 else len(charities_to_insert)} records into the 'charities' table.")
+        print(f"\nSuccessfully inserted {stats['merged']} of {stats['rows']} records into the 'charities' table.")
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -4,93 +4,37 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-import xml.etree.ElementTree as ET
-from multiprocessing import Pool, cpu_count
+from multiprocessing import Pool
 import psycopg2
-from psycopg2 import pool
-from psycopg2.extras import execute_batch
 from tqdm import tqdm
 
+from irs990_extractor import extract_filing
+from bulk_loader import bulk_insert
+
 # --- CONFIGURATION ---
 NUM_PROCESSES = 6
-db_pool = None
-
-def init_worker(db_dsn):
-    """Initializes a database connection pool for each worker process."""
-    global db_pool
-    db_pool = psycopg2.pool.SimpleConnectionPool(minconn=1, maxconn=2, dsn=db_dsn)
+GRANT_COLUMNS = ['foundation_ein', 'tax_year', 'recipient_name', 'grant_amount', 'grant_purpose', 'recipient_ein']
+FLUSH_EVERY_GRANTS = 50000 # grants buffered in the parent before one COPY
 
-def parse_and_save_data(filepath):
+def parse_grants(filepath):
     """
-    Parses a single 990 or 990-PF file and saves grant and officer data.
+    Parses a single 990 or 990-PF file and returns its grant rows, or None if it failed.
+    Workers only parse; the parent loads everything, so a staging table is created per
+    batch of grants rather than per filing.
     """
     try:
-        tree = ET.parse(filepath)
-        root = tree.getroot()
-        ns = {'irs': 'http://www.irs.gov/efile'}
-
-        def find_text(path, parent=root):
-            element = parent.find(path, ns)
-            return element.text.strip() if element is not None and element.text else None
-
-        ein = find_text('.//irs:Filer/irs:EIN')
-        if not ein: return False
-
-        tax_year = find_text('.//irs:TaxYr')
-        grants_data = []
-
-        # 1. Check for 990-PF grant format
-        pf_grant_elements = root.findall('.//irs:GrantOrContributionPdDurYrGrp', ns)
-        for grant in pf_grant_elements:
-            recipient_name = find_text('.//irs:RecipientBusinessName/irs:BusinessNameLine1Txt', parent=grant)
-            grant_amount_str = find_text('.//irs:Amt', parent=grant)
-            grant_purpose = find_text('.//irs:GrantOrContributionPurposeTxt', parent=grant)
-            if recipient_name and grant_amount_str:
-                try:
-                    grants_data.append({
-                        'foundation_ein': ein, 'tax_year': int(tax_year) if tax_year else None,
-                        'recipient_name': recipient_name, 'grant_amount': int(grant_amount_str),
-                        'grant_purpose': grant_purpose, 'recipient_ein': None # PF forms do not have recipient EIN
-                    })
-                except (ValueError, TypeError): continue
-
-        # 2. Check for 990 Schedule I grant format
-        schedule_i_elements = root.findall('.//irs:IRS990ScheduleI', ns)
-        for schedule in schedule_i_elements:
-            for grant in schedule.findall('.//irs:RecipientTable', ns):
-                recipient_name = find_text('.//irs:RecipientBusinessName/irs:BusinessNameLine1Txt', parent=grant)
-                grant_amount_str = find_text('.//irs:CashGrantAmt', parent=grant)
-                grant_purpose = find_text('.//irs:PurposeOfGrantTxt', parent=grant)
-                # --- THIS IS THE KEY UPGRADE ---
-                recipient_ein = find_text('.//irs:RecipientEIN', parent=grant)
-                if recipient_name and grant_amount_str:
-                    try:
-                        grants_data.append({
-                            'foundation_ein': ein, 'tax_year': int(tax_year) if tax_year else None,
-                            'recipient_name': recipient_name, 'grant_amount': int(grant_amount_str),
-                            'grant_purpose': grant_purpose, 'recipient_ein': recipient_ein
-                        })
-                    except (ValueError, TypeError): continue
-
-        if not grants_data: return True
-
-        conn = db_pool.getconn()
-        try:
-            with conn.cursor() as cursor:
-                execute_batch(cursor, """
-                    INSERT INTO grants (foundation_ein, tax_year, recipient_name, grant_amount, grant_purpose, recipient_ein)
-                    VALUES (%(foundation_ein)s, %(tax_year)s, %(recipient_name)s, %(grant_amount)s, %(grant_purpose)s, %(recipient_ein)s)
-                    ON CONFLICT DO NOTHING;
-                """, grants_data)
-            conn.commit()
-        except Exception:
-            conn.rollback()
-            return False
-        finally:
-            db_pool.putconn(conn)
-        return True
+        # One streaming pass pulls out the filer and both grant formats
+        # (990-PF GrantOrContributionPdDurYrGrp and Schedule I RecipientTable).
+        filing = extract_filing(filepath)
+        if not filing: return None
+        return filing['grants']
     except Exception:
-        return False
+        return None
+
+def flush_grants(conn, grants):
+    with conn.cursor() as cursor:
+        bulk_insert(cursor, 'grants', GRANT_COLUMNS, grants, report=False)
+    conn.commit()
 
 if __name__ == '__main__':
     print("--- Starting Upgraded Universal Grants Parser (with EIN capture) ---")
@@ -102,6 +46,10 @@ if __name__ == '__main__':
         print("Cleaning grants table before import...")
         cursor.execute("TRUNCATE grants RESTART IDENTITY;")
         conn.commit()
+        # Grants reference foundations; a filing whose filer isn't loaded fails on its own
+        # instead of failing the COPY batch it lands in
+        cursor.execute("SELECT ein FROM foundations")
+        foundation_eins = {row[0] for row in cursor.fetchall()}
     conn.close()
     print("Grants table cleaned.")
 
@@ -113,12 +61,27 @@ if __name__ == '__main__':
         print(f"ERROR: '{FILE_LIST_PATH}' not found.")
         exit()
 
+    success_count = 0
     if files_to_process:
         print(f"Found {len(files_to_process)} files to process...")
-        with Pool(processes=NUM_PROCESSES, initializer=init_worker, initargs=(db_dsn,)) as pool:
-            results = list(tqdm(pool.imap_unordered(parse_and_save_data, files_to_process), total=len(files_to_process), desc="Parsing Grants"))
-            success_count = sum(1 for r in results if r)
-    
+        conn = psycopg2.connect(db_dsn)
+        try:
+            buffer = []
+            with Pool(processes=NUM_PROCESSES) as pool:
+                for grants in tqdm(pool.imap_unordered(parse_grants, files_to_process, chunksize=16),
+                                   total=len(files_to_process), desc="Parsing Grants"):
+                    if grants is None or any(g['foundation_ein'] not in foundation_eins for g in grants):
+                        continue
+                    success_count += 1
+                    buffer.extend(grants)
+                    if len(buffer) >= FLUSH_EVERY_GRANTS:
+                        flush_grants(conn, buffer)
+                        buffer = []
+            if buffer:
+                flush_grants(conn, buffer)
+        finally:
+            conn.close()
+
     print(f"\n--- Import complete ---")
     print(f"Successfully processed: {success_count}/{len(files_to_process)}")
     print(f"Failed to process: {len(files_to_process) - success_count}/{len(files_to_process)}")
@@ -0,0 +1,130 @@
+# match_cache.py (Match-Result Cache Keyed on the Mission Statement)
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# --- CONFIGURATION ---
+MATCH_CACHE_BACKEND = os.environ.get("MATCH_CACHE_BACKEND", "memory") # 'memory' (per process) or 'sqlite' (shared by workers)
+MATCH_CACHE_PATH = os.environ.get("MATCH_CACHE_PATH", "match_cache.sqlite3")
+MATCH_CACHE_MAX_ENTRIES = int(os.environ.get("MATCH_CACHE_MAX_ENTRIES", 10000))
+MATCH_CACHE_TTL = float(os.environ.get("MATCH_CACHE_TTL", 24 * 3600)) # seconds
+
+def normalize_mission(mission_text):
+    """
+    Collapses whitespace and case. all-MiniLM-L6-v2 uses an uncased tokenizer, so
+    missions that differ only in case or spacing embed identically.
+    """
+    return re.sub(r'\s+', ' ', mission_text or '').strip().casefold()
+
+def mission_cache_key(mission_text, index_version):
+    """
+    The key covers both inputs of a match: the mission text and the published index.
+    Editing the mission or publishing a new index therefore never hits an old entry.
+    """
+    digest = hashlib.sha256(normalize_mission(mission_text).encode('utf-8')).hexdigest()
+    return f"{index_version}:{digest}"
+
+class MemoryMatchCache:
+    """An in-process LRU cache with a TTL. Each gunicorn worker holds its own copy."""
+    def __init__(self, max_entries=MATCH_CACHE_MAX_ENTRIES, ttl=MATCH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (index_version, stored_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[1] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, value, index_version):
+        with self._lock:
+            self._entries[key] = (index_version, time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def purge_stale(self, index_version):
+        """Drops every entry computed against a different index version."""
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[0] != index_version]:
+                del self._entries[key]
+
+class SqliteMatchCache:
+    """
+    An LRU cache with a TTL in a local SQLite file, so all workers on a host share hits.
+    Values are stored as JSON; connections are opened per thread and per process.
+    """
+    def __init__(self, path=MATCH_CACHE_PATH, max_entries=MATCH_CACHE_MAX_ENTRIES, ttl=MATCH_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS match_cache (
+                    key TEXT PRIMARY KEY,
+                    index_version TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS match_cache_last_used ON match_cache (last_used_at)")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute("SELECT value, stored_at FROM match_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > self.ttl:
+            conn.execute("DELETE FROM match_cache WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE match_cache SET last_used_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value, index_version):
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO match_cache (key, index_version, value, stored_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+            (key, index_version, json.dumps(value), now, now)
+        )
+        conn.execute("""
+            DELETE FROM match_cache WHERE key IN (
+                SELECT key FROM match_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+    def purge_stale(self, index_version):
+        """Drops every entry computed against a different index version."""
+        self._conn().execute("DELETE FROM match_cache WHERE index_version != ?", (index_version,))
+
+def get_match_cache(backend=MATCH_CACHE_BACKEND):
+    """Builds the configured cache backend."""
+    if backend == 'sqlite':
+        return SqliteMatchCache()
+    if backend == 'memory':
+        return MemoryMatchCache()
+    raise ValueError(f"Unknown MATCH_CACHE_BACKEND '{backend}'. Expected 'memory' or 'sqlite'.")
@@ -0,0 +1,115 @@
+# match_cascade.py (Multi-Stage Grant Recipient Matching with Provenance)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import sys
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from name_normalizer import normalize_name
+from fuzzy_matcher import NameIndex
+from charity_index import build_charity_indexes, match_grant_chunk
+from enrichment_runs import run_enrichment, matcher_version
+
+# --- CONFIGURATION ---
+NUM_PROCESSES = 6
+GEO_SCORE_CUTOFF = 95 # fuzzy match among charities in the foundation's state
+BLOCKED_SCORE_CUTOFF = 85 # fuzzy match among charities sharing the name's first 4 letters
+RUN_NAME = 'match_cascade' # checkpoint row in enrichment_runs
+# Cheapest and most certain first: each stage only sees the grants earlier stages left unmatched.
+STAGES = ('exact_ein', 'exact_name', 'geo_fuzzy', 'blocked_fuzzy')
+CASCADE_RULES = f"cascade:exact_ein,exact_name,geo_fuzzy@{GEO_SCORE_CUTOFF},blocked_fuzzy@{BLOCKED_SCORE_CUTOFF}"
+GRANT_QUERY = """
+    SELECT g.id, g.recipient_name, g.recipient_ein, f.state
+    FROM grants g
+    LEFT JOIN foundations f ON g.foundation_ein = f.ein
+    WHERE g.id > %(last_id)s
+      AND g.recipient_ein_matched IS NULL
+      AND (g.recipient_name IS NOT NULL OR g.recipient_ein IS NOT NULL)
+      AND g.match_attempts ->> %(run_name)s IS DISTINCT FROM %(version)s
+    ORDER BY g.id
+    LIMIT %(limit)s
+"""
+
+# --- GLOBAL INDEXES FOR WORKERS ---
+charity_indexes_global = None
+
+def init_worker(index_paths):
+    """Attaches each worker to the memory-mapped charity indexes; nothing is copied per process."""
+    global charity_indexes_global
+    charity_indexes_global = {group_by: NameIndex.open(path) for group_by, path in index_paths.items()}
+
+def match_exact_ein(chunk):
+    """Stage 1: the grant's own recipient EIN (990 Schedule I) is a known charity."""
+    matcher = charity_indexes_global['ein'].matcher('')
+    updates = []
+    for grant_id, _, _, recipient_ein in chunk:
+        match = matcher.lookup(recipient_ein.strip()) if matcher and recipient_ein else None
+        if match:
+            updates.append((grant_id, match[1], 'exact_ein', match[2]))
+    return updates
+
+def match_exact_name(chunk):
+    """Stage 2: the normalized recipient name equals a charity's, preferring the foundation's state."""
+    by_name = charity_indexes_global['name'].matcher('')
+    updates = []
+    for grant_id, recipient_name, state, _ in chunk:
+        normalized = normalize_name(recipient_name)
+        if not normalized:
+            continue
+        in_state = charity_indexes_global['state'].matcher(state) if state else None
+        match = (in_state and in_state.lookup(normalized)) or (by_name and by_name.lookup(normalized))
+        if match:
+            updates.append((grant_id, match[1], 'exact_name', match[2]))
+    return updates
+
+def run_cascade(chunk):
+    """Runs every stage over one chunk of grant tuples; returns (grant_id, ein, method, score) matches."""
+    stages = {
+        'exact_ein': match_exact_ein,
+        'exact_name': match_exact_name,
+        'geo_fuzzy': lambda grants: match_grant_chunk(charity_indexes_global['state'], grants, GEO_SCORE_CUTOFF, group_by='state'),
+        'blocked_fuzzy': lambda grants: match_grant_chunk(charity_indexes_global['prefix'], grants, BLOCKED_SCORE_CUTOFF, group_by='prefix'),
+    }
+    updates = []
+    remaining = chunk
+    for stage in STAGES:
+        if not remaining:
+            break
+        stage_updates = stages[stage](remaining)
+        matched_ids = {grant_id for grant_id, _, _, _ in stage_updates}
+        remaining = [grant for grant in remaining if grant[0] not in matched_ids]
+        updates.extend(stage_updates)
+    return updates
+
+def main():
+    conn = None
+    try:
+        db_url = os.environ.get("DATABASE_URL")
+        if not db_url:
+            raise ValueError("DATABASE_URL not found.")
+        conn = psycopg2.connect(db_url, cursor_factory=RealDictCursor)
+
+        print("--- Starting Grant Matching Cascade ---")
+        print(f"Stages: {', '.join(STAGES)}")
+
+        # Phase 1: Read the charities once and build every index the stages need
+        index_paths = build_charity_indexes(conn, ('ein', 'name', 'state', 'prefix'))
+
+        # Phase 2: Cascade over id-ordered chunks, committing each chunk with its checkpoint
+        run_enrichment(
+            conn, RUN_NAME, GRANT_QUERY, matcher_version(CASCADE_RULES, BLOCKED_SCORE_CUTOFF), BLOCKED_SCORE_CUTOFF,
+            run_cascade, init_worker, (index_paths,), NUM_PROCESSES,
+            restart='--restart' in sys.argv
+        )
+
+    except Exception as e:
+        print(f"\nAn error occurred: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    main()
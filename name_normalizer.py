@@ -0,0 +1,57 @@
+# name_normalizer.py (Shared, Versioned Organization-Name Normalizer)
+
+import re
+
+# --- RULE SETS ---
+# Every rule set is frozen once its output has been stored in the database: change the
+# words in a new version instead of editing an old one, so stored normalized_name values
+# stay reproducible from the normalized_name_version recorded next to them.
+RULESETS = {
+    # The list used by precompute_normalized_names.py and the enrichment scripts.
+    'v1': (
+        'INC', 'INCORPORATED', 'LLC', 'CORP', 'CORPORATION', 'FOUNDATION',
+        'FDN', 'FUND', 'TRUST', 'CHARITABLE', 'CHARITY', 'ASSOCIATION',
+        'THE', 'AND', 'OF', 'FOR'
+    ),
+    # The broader list from test_high_speed_enrichment.py (also strips institution types).
+    'v1-ext': (
+        'INC', 'INCORPORATED', 'LLC', 'L L C', 'CORP', 'CORPORATION',
+        'FOUNDATION', 'FDN', 'FUND', 'TRUST', 'CHARITABLE', 'CHARITY',
+        'ASSOCIATION', 'SOCIETY', 'LEAGUE', 'CLUB', 'CENTER',
+        'UNIVERSITY', 'UNIV', 'COLLEGE', 'SCHOOL', 'HOSPITAL',
+        'THE', 'AND', 'OF', 'FOR', 'PROGRAM', 'DEPARTMENT'
+    ),
+}
+CURRENT_VERSION = 'v1'
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+
+def _compile_ruleset(words):
+    # One alternation instead of one re.sub per word. Longest words first, so a phrase
+    # like 'L L C' or 'INCORPORATED' is tried before anything it starts with.
+    alternation = '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+    return re.compile(r'\b(?:' + alternation + r')\b')
+
+_COMPILED_RULESETS = {version: _compile_ruleset(words) for version, words in RULESETS.items()}
+
+def _ruleset(version):
+    try:
+        return _COMPILED_RULESETS[version]
+    except KeyError:
+        raise ValueError(f"Unknown normalizer version '{version}'. Expected one of {sorted(RULESETS)}.")
+
+def normalize_name(name, version=CURRENT_VERSION):
+    """A consistent function to clean and simplify organization names."""
+    if not name: return ""
+    name = _PUNCTUATION.sub('', name.upper().replace('&', 'AND'))
+    # split()/join() collapses the whitespace left behind in the same step as stripping it
+    return ' '.join(_ruleset(version).sub('', name).split())
+
+def normalize_names(names, version=CURRENT_VERSION):
+    """Normalizes a whole list or column of names at once, returning a list in the same order."""
+    removal = _ruleset(version).sub
+    punctuation = _PUNCTUATION.sub
+    return [
+        ' '.join(removal('', punctuation('', name.upper().replace('&', 'AND'))).split()) if name else ""
+        for name in names
+    ]
@@ -4,13 +4,13 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-import xml.etree.ElementTree as ET
 from multiprocessing import Pool, cpu_count
 import psycopg2
 from psycopg2 import pool
-from psycopg2.extras import execute_batch
 from tqdm import tqdm
-import re
+
+from irs990_extractor import extract_filing
+from bulk_loader import bulk_insert, bulk_update
 
 # --- CONFIGURATION ---
 FILE_LIST_PATH = "charity_file_list.txt"
@@ -31,53 +31,23 @@ def convert_windows_path_to_wsl(path):
 
 def parse_charity_data(filepath):
     """
-    Parses a single Form 990 XML file to extract rich charity data.
+    Streams a single Form 990 XML file to extract rich charity data.
     """
-    try:
-        # Use a regex to strip namespaces, which is more robust for these files
-        with open(filepath, 'r', encoding='utf-8') as f:
-            xml_content = f.read()
-        # This regex removes both the xmlns attribute and the nsX: prefixes
-        xml_content = re.sub(r'\sxmlns(:\w+)?="[^"]+"', '', xml_content)
-        xml_content = re.sub(r'<\w+:', '<', xml_content)
-        xml_content = re.sub(r'</\w+:', '</', xml_content)
-        
-        root = ET.fromstring(xml_content)
-
-        def find_text(path, parent=root):
-            element = parent.find(path)
-            return element.text.strip() if element is not None and element.text else None
-
-        ein = find_text('.//Filer/EIN')
-        if not ein: return None
-
-        charity_profile = {
-            'ein': ein,
-            'mission_statement': find_text('.//MissionDesc') or find_text('.//ActivityOrMissionDesc'),
-            'address_line_1': find_text('.//Filer/USAddress/AddressLine1Txt'),
-            'zip_code': find_text('.//Filer/USAddress/ZIPCd')
-        }
-        
-        financials = []
-        tax_year = find_text('.//TaxYr')
-        cy_revenue = find_text('.//CYTotalRevenueAmt')
-        cy_expenses = find_text('.//CYTotalExpensesAmt')
-        
-        if tax_year and (cy_revenue or cy_expenses):
-            try:
-                financials.append({
-                    'ein': ein, 
-                    'tax_year': int(tax_year),
-                    'total_revenue': int(cy_revenue) if cy_revenue else None,
-                    'total_expenses': int(cy_expenses) if cy_expenses else None
-                })
-            except (ValueError, TypeError):
-                pass # Ignore if financial data is not a valid number
-            
-        return (charity_profile, financials)
-            
-    except (ET.ParseError, FileNotFoundError, AttributeError):
+    # iterparse resolves namespaces itself, so the old regex namespace-stripping passes
+    # over the whole file are no longer needed.
+    filing = extract_filing(filepath)
+    if not filing:
         return None
+    filer = filing['filer']
+
+    charity_profile = {
+        'ein': filer['ein'],
+        'mission_statement': filer['mission_desc'] or filer['activity_or_mission_desc'],
+        'address_line_1': filer['address_line_1'],
+        'zip_code': filer['zip_code']
+    }
+    financials = [filing['financials']] if filing['financials'] else []
+    return (charity_profile, financials)
 
 def main():
     print("--- Starting Final Enhanced Public Charity Parser (10,000 FILE TEST) ---")
@@ -112,9 +82,7 @@ def main():
         with conn.cursor() as cursor:
             if profile_updates:
                 print(f"\nFound {len(profile_updates)} charities with mission statements. Updating main profiles...")
-                execute_batch(cursor, 
-                    "UPDATE charities SET mission_statement = %(mission_statement)s, address_line_1 = %(address_line_1)s, zip_code = %(zip_code)s WHERE ein = %(ein)s",
-                    profile_updates)
+                bulk_update(cursor, 'charities', ['ein'], ['mission_statement', 'address_line_1', 'zip_code'], profile_updates)
                 conn.commit()
                 print("Charity profiles updated.")
 
@@ -122,13 +90,8 @@ def main():
                 print(f"\nFound {len(financial_records)} annual financial records. Inserting...")
                 # Clean the financials table before inserting new test data
                 cursor.execute("TRUNCATE charity_financials RESTART IDENTITY;")
-                execute_batch(cursor,
-                    """
-                    INSERT INTO charity_financials (ein, tax_year, total_revenue, total_expenses)
-                    VALUES (%(ein)s, %(tax_year)s, %(total_revenue)s, %(total_expenses)s)
-                    ON CONFLICT (ein, tax_year) DO NOTHING;
-                    """,
-                    financial_records)
+                bulk_insert(cursor, 'charity_financials', ['ein', 'tax_year', 'total_revenue', 'total_expenses'], financial_records,
+                            on_conflict="ON CONFLICT (ein, tax_year) DO NOTHING")
                 conn.commit()
                 print("Financial records inserted.")
                 
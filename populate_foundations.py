@@ -4,15 +4,17 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-import xml.etree.ElementTree as ET
 from multiprocessing import Pool, cpu_count
 import psycopg2
 from psycopg2 import pool
-from psycopg2.extras import execute_batch
 from tqdm import tqdm
 
+from irs990_extractor import extract_filing
+from bulk_loader import bulk_insert
+
 # --- CONFIGURATION ---
 NUM_PROCESSES = 6
+FOUNDATION_COLUMNS = ['ein', 'name', 'address_line_1', 'city', 'state', 'zip_code', 'assets_fmv', 'mission_statement']
 db_pool = None
 
 def init_worker(db_dsn):
@@ -22,31 +24,25 @@ def init_worker(db_dsn):
 
 def parse_foundation_data(filepath):
     """
-    Parses a single XML file and extracts ONLY the foundation's core data.
+    Streams a single XML file and extracts ONLY the foundation's core data.
     Returns a dictionary of the foundation data on success, None on failure.
     """
     try:
-        tree = ET.parse(filepath)
-        root = tree.getroot()
-        ns = {'irs': 'http://www.irs.gov/efile'}
-
-        def find_text(path, parent=root):
-            element = parent.find(path, ns)
-            return element.text.strip() if element is not None and element.text else None
-
-        ein = find_text('.//irs:Filer/irs:EIN')
-        if not ein:
+        filing = extract_filing(filepath)
+        if not filing:
             return None
+        filer = filing['filer']
 
         # Extract data, providing None as a default for missing fields
         foundation_data = {
-            'ein': ein,
-            'name': find_text('.//irs:Filer/irs:BusinessName/irs:BusinessNameLine1Txt'),
-            'address_line_1': find_text('.//irs:Filer/irs:USAddress/irs:AddressLine1Txt'),
-            'city': find_text('.//irs:Filer/irs:USAddress/irs:CityNm'),
-            'state': find_text('.//irs:Filer/irs:USAddress/irs:StateAbbreviationCd'),
-            'zip_code': find_text('.//irs:Filer/irs:USAddress/irs:ZIPCd'),
-            'mission_statement': find_text('.//irs:ActivityOrMissionDesc') or find_text('.//irs:MissionDesc')
+            'ein': filer['ein'],
+            'name': filer['name'],
+            'address_line_1': filer['address_line_1'],
+            'city': filer['city'],
+            'state': filer['state'],
+            'zip_code': filer['zip_code'],
+            'assets_fmv': filer['assets_fmv'],
+            'mission_statement': filer['activity_or_mission_desc'] or filer['mission_desc']
         }
 
         # Only return data if we have the essentials: EIN and Name
@@ -96,14 +92,7 @@ if __name__ == '__main__':
             conn = psycopg2.connect(db_dsn)
             try:
                 with conn.cursor() as cursor:
-                    execute_batch(cursor,
-                      """
-                      INSERT INTO foundations (ein, name, address_line_1, city, state, zip_code, mission_statement)
-                      VALUES (%(ein)s, %(name)s, %(address_line_1)s, %(city)s, %(state)s, %(zip_code)s, %(mission_statement)s)
-                      ON CONFLICT (ein) DO NOTHING;
-                      """,
-                      foundations_to_insert
-                    )
+                    bulk_insert(cursor, 'foundations', FOUNDATION_COLUMNS, foundations_to_insert, on_conflict="ON CONFLICT (ein) DO NOTHING")
                     conn.commit()
                 print("Successfully inserted foundation data.")
             except Exception as e:
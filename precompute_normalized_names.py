@@ -4,39 +4,69 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-import re
+import sys
 import psycopg2
-from psycopg2.extras import RealDictCursor, execute_batch
+from psycopg2.extras import RealDictCursor
 from tqdm import tqdm
 from multiprocessing import Pool
+from collections import deque
+
+from name_normalizer import normalize_names, CURRENT_VERSION as NORMALIZER_VERSION
+from db_stream import stream_batches, count_rows
+from bulk_loader import bulk_update
 
 # --- CONFIGURATION ---
 NUM_PROCESSES = 6
-
-def normalize_name(name):
-    """A consistent function to clean and simplify organization names."""
-    if not name: return ""
-    name = name.upper().replace('&', 'AND')
-    name = re.sub(r'[^\w\s]', '', name)
-    suffixes_to_remove = [
-        'INC', 'INCORPORATED', 'LLC', 'CORP', 'CORPORATION', 'FOUNDATION',
-        'FDN', 'FUND', 'TRUST', 'CHARITABLE', 'CHARITY', 'ASSOCIATION',
-        'THE', 'AND', 'OF', 'FOR'
-    ]
-    for suffix in suffixes_to_remove:
-        name = re.sub(r'\b' + re.escape(suffix) + r'\b', '', name)
-    return re.sub(r'\s+', ' ', name).strip()
+BATCH_SIZE = 50000 # rows per COPY + UPDATE ... FROM chunk, committed one at a time
+MAX_BATCHES_IN_FLIGHT = NUM_PROCESSES # bounds how far the stream reads ahead of the workers
 
 def process_batch(batch):
-    """Worker function to normalize a batch of names."""
-    updates = []
-    for record in batch:
-        # Assumes record has an 'id' and a 'name' or 'recipient_name'
-        record_id = record.get('id') or record.get('ein')
-        name_to_process = record.get('name') or record.get('recipient_name')
-        if record_id and name_to_process:
-            updates.append((normalize_name(name_to_process), record_id))
-    return updates
+    """
+    Worker function to normalize a batch of (key, name) rows in one call. Every row gets a
+    result, including names that normalize to '' (blank, or nothing but removed words):
+    '' with the rule version marks them done, so incremental runs don't read them again.
+    """
+    normalized = normalize_names([name for _, name in batch], NORMALIZER_VERSION)
+    return [(record_id, normalized_name, NORMALIZER_VERSION) for normalized_name, (record_id, _) in zip(normalized, batch)]
+
+def normalize_table(conn, pool, table, key_column, name_column, incremental, desc):
+    """
+    Streams (key, name) rows in batches and normalizes them on the pool. Each batch is
+    COPYed into a staging table and applied with one UPDATE ... FROM join, then committed,
+    so neither the rows nor the updates pile up in memory. With `incremental`, only rows
+    never normalized or normalized by an older rule set are read.
+    """
+    query = f"SELECT {key_column}, {name_column} FROM {table} WHERE {name_column} IS NOT NULL"
+    params = None
+    if incremental:
+        query += " AND (normalized_name IS NULL OR normalized_name_version IS DISTINCT FROM %s)"
+        params = (NORMALIZER_VERSION,)
+    total = count_rows(conn, query, params)
+    if not total:
+        print(f"All {desc.lower()} are already normalized with rule set {NORMALIZER_VERSION}.")
+        return 0
+    print(f"Normalizing {total} {desc.lower()}...")
+    updated = 0
+    # Batches are handed out from this thread (pool.imap would drain the whole stream up
+    # front), so at most MAX_BATCHES_IN_FLIGHT batches are in memory at any time.
+    pending = deque()
+    with tqdm(total=total, desc=f"Processing {desc}") as progress:
+        def write_oldest():
+            nonlocal updated
+            updates = pending.popleft().get()
+            with conn.cursor() as cursor:
+                bulk_update(cursor, table, [key_column], ['normalized_name', 'normalized_name_version'], updates, report=False)
+            conn.commit() # the stream is WITH HOLD, so it survives the per-chunk commit
+            updated += len(updates)
+            progress.update(len(updates))
+
+        for batch in stream_batches(conn, query, params, batch_size=BATCH_SIZE, row_type='tuple', withhold=True):
+            pending.append(pool.apply_async(process_batch, (batch,)))
+            if len(pending) >= MAX_BATCHES_IN_FLIGHT:
+                write_oldest()
+        while pending:
+            write_oldest()
+    return updated
 
 def main():
     conn = None
@@ -45,44 +75,24 @@ def main():
         conn = psycopg2.connect(db_url, cursor_factory=RealDictCursor)
         
         print("--- Starting Pre-computation of Normalized Names ---")
+        # --incremental only touches rows that are unnormalized or from an older rule set (for nightly runs)
+        incremental = '--incremental' in sys.argv
+        print(f"Normalizer rule set: {NORMALIZER_VERSION} ({'incremental' if incremental else 'full'} run)")
 
-        # --- Process Charities Table ---
+        # Record which rule set produced each stored normalized_name
         with conn.cursor() as cursor:
-            print("Fetching all charities...")
-            cursor.execute("SELECT ein, name FROM charities WHERE name IS NOT NULL")
-            all_charities = cursor.fetchall()
+            cursor.execute("ALTER TABLE charities ADD COLUMN IF NOT EXISTS normalized_name_version TEXT;")
+            cursor.execute("ALTER TABLE grants ADD COLUMN IF NOT EXISTS normalized_name_version TEXT;")
+            conn.commit()
 
-        if all_charities:
-            print(f"Normalizing {len(all_charities)} charity names...")
-            charity_batches = [all_charities[i:i + 10000] for i in range(0, len(all_charities), 10000)]
-            with Pool(processes=NUM_PROCESSES) as pool:
-                results = list(tqdm(pool.imap(process_batch, charity_batches), total=len(charity_batches), desc="Processing Charities"))
-            
-            charity_updates = [item for sublist in results for item in sublist]
-            
-            print("Updating charities table in the database...")
-            with conn.cursor() as cursor:
-                execute_batch(cursor, "UPDATE charities SET normalized_name = %s WHERE ein = %s", charity_updates)
-                conn.commit()
-
-        # --- Process Grants Table ---
-        with conn.cursor() as cursor:
-            print("\nFetching all grants...")
-            cursor.execute("SELECT id, recipient_name FROM grants WHERE recipient_name IS NOT NULL")
-            all_grants = cursor.fetchall()
+        with Pool(processes=NUM_PROCESSES) as pool:
+            # --- Process Charities Table ---
+            print("Streaming charities...")
+            normalize_table(conn, pool, 'charities', 'ein', 'name', incremental, "Charity Names")
 
-        if all_grants:
-            print(f"Normalizing {len(all_grants)} grant recipient names...")
-            grant_batches = [all_grants[i:i + 10000] for i in range(0, len(all_grants), 10000)]
-            with Pool(processes=NUM_PROCESSES) as pool:
-                results = list(tqdm(pool.imap(process_batch, grant_batches), total=len(grant_batches), desc="Processing Grants"))
-
-            grant_updates = [item for sublist in results for item in sublist]
-            
-            print("Updating grants table in the database...")
-            with conn.cursor() as cursor:
-                execute_batch(cursor, "UPDATE grants SET normalized_name = %s WHERE id = %s", grant_updates)
-                conn.commit()
+            # --- Process Grants Table ---
+            print("\nStreaming grants...")
+            normalize_table(conn, pool, 'grants', 'id', 'recipient_name', incremental, "Grant Recipient Names")
 
         print("\n--- Pre-computation complete. Database is now optimized for fast joins. ---")
 
@@ -1,15 +1,160 @@
-# precompute_scores.py (FINAL - Self-Contained Setup & Execution)
+# precompute_scores.py (FINAL - Self-Contained Setup & Execution, Full or Incremental)
 
 from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import sys
+import time
 import psycopg2
-from psycopg2.extras import RealDictCursor, execute_batch
-from tqdm import tqdm
-import numpy as np
-import math
-from collections import defaultdict
+from psycopg2.extras import RealDictCursor
+
+from initialize_database import SCORE_CHANGE_LOG_TRIGGERS
+
+# --- CONFIGURATION ---
+TRIM_FRACTION = 0.05 # share of the smallest and of the largest grants left out of the smart ask
+# One row per foundation, in foundation_scores' column order:
+# - giving velocity: total of its matched grants
+# - national funder: 100 for recipients in more than 10 states, 50 for 5-10, else 0
+# - smart ask: mean of its non-zero matched grants after trimming TRIM_FRACTION from each end
+#   (floor(n * fraction) grants, so fewer than 20 grants are never trimmed)
+# - financial score: 10 * log10(assets), capped at 100
+FOUNDATION_SCORES_QUERY = """
+    WITH matched AS (
+        SELECT g.foundation_ein, g.grant_amount, NULLIF(c.state, '') AS recipient_state
+        FROM grants g
+        JOIN charities c ON g.recipient_ein_matched = c.ein
+        WHERE g.recipient_ein_matched IS NOT NULL {grant_filter}
+    ),
+    ranked AS (
+        SELECT foundation_ein, grant_amount,
+               ROW_NUMBER() OVER (PARTITION BY foundation_ein ORDER BY grant_amount) AS amount_rank,
+               COUNT(*) OVER (PARTITION BY foundation_ein) AS amount_count
+        FROM matched
+        WHERE grant_amount <> 0
+    ),
+    asks AS (
+        SELECT foundation_ein,
+               AVG(grant_amount) FILTER (
+                   WHERE amount_rank > FLOOR(amount_count * %(trim_fraction)s)
+                     AND amount_rank <= amount_count - FLOOR(amount_count * %(trim_fraction)s)
+               ) AS smart_ask_amount
+        FROM ranked
+        GROUP BY foundation_ein
+    ),
+    giving AS (
+        SELECT foundation_ein,
+               SUM(COALESCE(grant_amount, 0)) AS giving_velocity,
+               COUNT(DISTINCT recipient_state) AS num_states
+        FROM matched
+        GROUP BY foundation_ein
+    )
+    SELECT f.ein AS foundation_ein,
+           0 AS geo_score,
+           CASE WHEN f.assets_fmv > 0 THEN TRUNC(LEAST(100, LOG(f.assets_fmv::double precision) * 10))::int ELSE 0 END AS financial_score,
+           TRUNC(COALESCE(gv.giving_velocity, 0))::bigint AS giving_velocity_score,
+           CASE WHEN gv.num_states > 10 THEN 100 WHEN gv.num_states >= 5 THEN 50 ELSE 0 END AS national_funder_score,
+           COALESCE(a.smart_ask_amount, 0) AS smart_ask_amount
+    FROM foundations f
+    LEFT JOIN giving gv ON gv.foundation_ein = f.ein
+    LEFT JOIN asks a ON a.foundation_ein = f.ein
+    {foundation_filter}
+"""
+SCORE_COLUMNS = ['foundation_ein', 'geo_score', 'financial_score', 'giving_velocity_score', 'national_funder_score', 'smart_ask_amount']
+SCORES_LOCK_KEY = 'foundation_scores' # advisory lock: one scoring run at a time
+
+def foundation_scores_query(restricted=False):
+    """The scoring query for every foundation, or only those in %(foundation_eins)s."""
+    if not restricted:
+        return FOUNDATION_SCORES_QUERY.format(grant_filter='', foundation_filter='')
+    return FOUNDATION_SCORES_QUERY.format(grant_filter='AND g.foundation_ein = ANY(%(foundation_eins)s)',
+                                          foundation_filter='WHERE f.ein = ANY(%(foundation_eins)s)')
+
+def missing_change_log(cursor):
+    """
+    Names whatever part of the change log initialize_database.py hasn't installed: the
+    table and each trigger, as 'table.trigger'. Reads the catalogs only, so no table is locked.
+    """
+    cursor.execute("SELECT to_regclass('foundation_score_changes') IS NOT NULL AS installed")
+    missing = [] if cursor.fetchone()['installed'] else ['foundation_score_changes']
+    cursor.execute("""
+        SELECT c.relname AS table_name, t.tgname AS trigger_name
+        FROM pg_trigger t JOIN pg_class c ON c.oid = t.tgrelid
+        WHERE NOT t.tgisinternal AND c.relname = ANY(%s)
+    """, (list(SCORE_CHANGE_LOG_TRIGGERS),))
+    installed = {(row['table_name'], row['trigger_name']) for row in cursor.fetchall()}
+    missing.extend(f"{table}.{trigger}" for table, triggers in SCORE_CHANGE_LOG_TRIGGERS.items()
+                   for trigger in triggers if (table, trigger) not in installed)
+    return missing
+
+def consume_changes(cursor):
+    """
+    Takes every logged change and returns the set of foundation EINs (None = all). The rows
+    are deleted in the caller's transaction, so they come back if the run rolls back, and
+    changes logged after this point stay for the next run.
+    """
+    cursor.execute("DELETE FROM foundation_score_changes RETURNING foundation_ein")
+    return {row['foundation_ein'] for row in cursor.fetchall()}
+
+def rebuild_all_scores(conn, change_log=True):
+    """
+    Scores every foundation into a shadow table and swaps it in for foundation_scores in the
+    same transaction, so readers keep the old table until the new one is complete.
+    Pass change_log=False when the change log table doesn't exist.
+    Returns the number of foundations scored.
+    """
+    column_list = ', '.join(SCORE_COLUMNS)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (SCORES_LOCK_KEY,))
+        if change_log:
+            consume_changes(cursor) # everything is recomputed below
+        cursor.execute("DROP TABLE IF EXISTS foundation_scores_shadow;")
+        cursor.execute("CREATE TABLE foundation_scores_shadow (LIKE foundation_scores INCLUDING ALL);")
+        cursor.execute(f"INSERT INTO foundation_scores_shadow ({column_list}) {foundation_scores_query()}",
+                       {'trim_fraction': TRIM_FRACTION})
+        scored = cursor.rowcount
+        # The swap holds an exclusive lock only for these renames, until the commit
+        cursor.execute("ALTER TABLE foundation_scores RENAME TO foundation_scores_old;")
+        cursor.execute("ALTER TABLE foundation_scores_shadow RENAME TO foundation_scores;")
+        cursor.execute("DROP TABLE foundation_scores_old;")
+        cursor.execute("ALTER INDEX foundation_scores_shadow_pkey RENAME TO foundation_scores_pkey;")
+        cursor.execute("GRANT ALL PRIVILEGES ON TABLE foundation_scores TO granterai_user;")
+    conn.commit()
+    return scored
+
+def update_changed_scores(conn):
+    """
+    Recomputes only the foundations in the change log and upserts them in one transaction,
+    so readers see either all of the old scores or all of the new ones. Falls back to
+    rebuild_all_scores() when a table was truncated. Returns (mode, foundations scored).
+    """
+    column_list = ', '.join(SCORE_COLUMNS)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (SCORES_LOCK_KEY,))
+        changed = consume_changes(cursor)
+        if None in changed:
+            conn.rollback()
+            print("A source table was reloaded since the last run; rebuilding every score.")
+            return 'full', rebuild_all_scores(conn)
+        if changed:
+            params = {'trim_fraction': TRIM_FRACTION, 'foundation_eins': list(changed)}
+            cursor.execute(f"""
+                INSERT INTO foundation_scores ({column_list}) {foundation_scores_query(restricted=True)}
+                ON CONFLICT (foundation_ein) DO UPDATE SET
+                    geo_score = EXCLUDED.geo_score,
+                    financial_score = EXCLUDED.financial_score,
+                    giving_velocity_score = EXCLUDED.giving_velocity_score,
+                    national_funder_score = EXCLUDED.national_funder_score,
+                    smart_ask_amount = EXCLUDED.smart_ask_amount
+            """, params)
+            # Foundations that were deleted
+            cursor.execute("""
+                DELETE FROM foundation_scores fs
+                WHERE fs.foundation_ein = ANY(%(foundation_eins)s)
+                  AND NOT EXISTS (SELECT 1 FROM foundations f WHERE f.ein = fs.foundation_ein)
+            """, params)
+    conn.commit()
+    return 'incremental', len(changed)
 
 def main():
     conn = None
@@ -18,9 +163,9 @@ def main():
         raise ValueError("DATABASE_URL not found.")
 
     try:
-        # --- Step 1: Ensure Table Exists and Permissions are Set ---
+        # --- Step 1: Ensure the Scores Table and Permissions are Set; Check the Change Log ---
         print("--- Ensuring database is set up correctly... ---")
-        conn = psycopg2.connect(db_url)
+        conn = psycopg2.connect(db_url, cursor_factory=RealDictCursor)
         with conn.cursor() as cursor:
             # Try to create the table, but don't fail if it's already there
             cursor.execute("""
@@ -33,87 +178,31 @@ def main():
                     smart_ask_amount NUMERIC
                 );
             """)
+            missing = missing_change_log(cursor)
             # Grant permissions just in case
             cursor.execute("GRANT ALL PRIVILEGES ON TABLE foundation_scores TO granterai_user;")
             conn.commit()
         conn.close()
         print("Database setup verified.")
+        if missing:
+            print(f"WARNING: The score change log is incomplete (missing: {', '.join(missing)}). "
+                  f"Run initialize_database.py to install it; until then every run is a full rebuild.")
 
         # --- Step 2: Run the Scoring Logic ---
         conn = psycopg2.connect(db_url, cursor_factory=RealDictCursor)
         print("--- Starting Pre-computation of Foundation Scores ---")
 
-        with conn.cursor() as cursor:
-            print("Fetching all foundations...")
-            cursor.execute("SELECT ein, city, state, assets_fmv FROM foundations;")
-            foundations = cursor.fetchall()
-            
-            print("Fetching all grant data...")
-            cursor.execute("""
-                SELECT g.foundation_ein, g.grant_amount, c.state AS recipient_state 
-                FROM grants g
-                JOIN charities c ON g.recipient_ein_matched = c.ein
-                WHERE g.recipient_ein_matched IS NOT NULL;
-            """)
-            grants = cursor.fetchall()
-
-        # (Calculation logic remains the same as it's proven to be fast)
-        giving_velocity = defaultdict(float)
-        national_funder = defaultdict(set)
-        for grant in tqdm(grants, desc="Processing Grant Data"):
-            ein = grant['foundation_ein']
-            giving_velocity[ein] += (grant['grant_amount'] or 0)
-            if grant['recipient_state']:
-                national_funder[ein].add(grant['recipient_state'])
-
-        smart_ask_amounts = {}
-        grants_by_foundation = defaultdict(list)
-        for grant in grants:
-            if grant['grant_amount']:
-                grants_by_foundation[grant['foundation_ein']].append(grant['grant_amount'])
-        
-        for ein, amounts in tqdm(grants_by_foundation.items(), desc="Calculating Ask Amounts"):
-            if len(amounts) < 3:
-                smart_ask_amounts[ein] = np.mean(amounts) if amounts else 0
-                continue
-            amounts.sort()
-            trim_count = int(len(amounts) * 0.05)
-            trimmed_amounts = amounts[trim_count:-trim_count] if trim_count > 0 else amounts
-            smart_ask_amounts[ein] = np.mean(trimmed_amounts) if trimmed_amounts else 0
-
-        scores_to_insert = []
-        for f in foundations:
-            ein = f['ein']
-            assets = f.get('assets_fmv')
-            financial_score = min(100, math.log10(assets) * 10) if assets and assets > 0 else 0
-            num_states = len(national_funder.get(ein, set()))
-            national_score = 100 if num_states > 10 else (50 if num_states >= 5 else 0)
-            
-            scores_to_insert.append({
-                'foundation_ein': ein,
-                'geo_score': 0, 'financial_score': int(financial_score),
-                'giving_velocity_score': int(giving_velocity.get(ein, 0)),
-                'national_funder_score': national_score,
-                'smart_ask_amount': smart_ask_amounts.get(ein, 0)
-            })
-
-        print(f"\nFound {len(scores_to_insert)} foundations to score. Updating database...")
-        with conn.cursor() as cursor:
-            cursor.execute("TRUNCATE foundation_scores;")
-            execute_batch(cursor,
-                """
-                INSERT INTO foundation_scores (foundation_ein, geo_score, financial_score, giving_velocity_score, national_funder_score, smart_ask_amount)
-                VALUES (%(foundation_ein)s, %(geo_score)s, %(financial_score)s, %(giving_velocity_score)s, %(national_funder_score)s, %(smart_ask_amount)s)
-                ON CONFLICT (foundation_ein) DO UPDATE SET
-                    financial_score = EXCLUDED.financial_score,
-                    giving_velocity_score = EXCLUDED.giving_velocity_score,
-                    national_funder_score = EXCLUDED.national_funder_score,
-                    smart_ask_amount = EXCLUDED.smart_ask_amount;
-                """,
-                scores_to_insert
-            )
-            conn.commit()
-            print("Successfully pre-computed and stored foundation scores.")
+        # The computation runs in Postgres as grouped aggregates, so no grant rows are
+        # shipped to Python. --incremental only rescores foundations in the change log.
+        started = time.perf_counter()
+        if '--incremental' in sys.argv and not missing:
+            print("Scoring foundations with new or changed grants...")
+            mode, scored = update_changed_scores(conn)
+        else:
+            print("Scoring all foundations into a shadow table...")
+            mode, scored = 'full', rebuild_all_scores(conn, change_log='foundation_score_changes' not in missing)
+        print(f"Successfully pre-computed and stored scores for {scored} foundations ({mode}) "
+              f"in {time.perf_counter() - started:.1f}s.")
 
     except Exception as e:
         print(f"\nAn error occurred: {e}")
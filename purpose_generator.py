@@ -0,0 +1,440 @@
+# purpose_generator.py (Async Gemini Purpose Generation with Rate Limiting, Retries and Streaming Writes)
+
+import os
+import json
+import time
+import hashlib
+import random
+import asyncio
+from collections import Counter
+import aiohttp
+from psycopg2 import sql
+from tqdm import tqdm
+
+from bulk_loader import copy_into_staging, bulk_insert
+
+# --- CONFIGURATION ---
+GEMINI_MODEL = 'gemini-1.5-flash'
+# Bump whenever build_purpose_prompt() or build_batch_prompt() changes meaning: cached purposes
+# from other versions stop matching, and --purge-stale-cache deletes them.
+PROMPT_TEMPLATE_VERSION = 'purpose-v1'
+# Point this at fake_llm_server.py (e.g. http://127.0.0.1:8089) to run against a local stand-in
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("GEMINI_MAX_CONCURRENCY", 32)) # requests in flight at once
+REQUESTS_PER_MINUTE = float(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", 1000)) # the project's quota
+RATE_BURST = 10 # requests the token bucket lets through back to back
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 1.0 # seconds; the backoff cap doubles per attempt, with full jitter
+BACKOFF_MAX = 60.0
+REQUEST_TIMEOUT = 60 # seconds per HTTP request
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+WRITE_BATCH_SIZE = 500 # generated purposes per committed write
+WRITE_INTERVAL = 5.0 # seconds; pending purposes are written at least this often
+# Batching: one request carries up to this many pairs of the same foundation (1 = one pair per request)
+PAIRS_PER_REQUEST = int(os.environ.get("GEMINI_PAIRS_PER_REQUEST", 20))
+MAX_PURPOSE_LENGTH = 300 # characters; a longer batch item is treated as malformed
+# Structured output: the model must answer a batch with [{"id": 1, "purpose": "..."}, ...]
+BATCH_GENERATION_CONFIG = {
+    'responseMimeType': 'application/json',
+    'responseSchema': {
+        'type': 'ARRAY',
+        'items': {
+            'type': 'OBJECT',
+            'properties': {'id': {'type': 'INTEGER'}, 'purpose': {'type': 'STRING'}},
+            'required': ['id', 'purpose'],
+        },
+    },
+}
+
+MISSING_PURPOSE_QUERY = """
+    SELECT DISTINCT g.foundation_ein, f.name AS foundation_name, f.mission_statement, c.name AS recipient_name, g.recipient_ein_matched
+    FROM grants g
+    JOIN foundations f ON g.foundation_ein = f.ein
+    JOIN charities c ON g.recipient_ein_matched = c.ein
+    WHERE g.grant_purpose IS NULL AND g.recipient_ein_matched IS NOT NULL
+"""
+
+def build_purpose_prompt(task):
+    """The prompt for one foundation/recipient pair, or None if the pair lacks the context to ask about."""
+    if not task.get('mission_statement') or not task.get('recipient_name') or not task.get('foundation_name'):
+        return None
+    return f"""
+    Analyze the following information:
+    1. A foundation named "{task['foundation_name']}" has a mission: "{task['mission_statement']}"
+    2. This foundation gave a grant to an organization named: "{task['recipient_name']}"
+
+    Based only on this context, write a single, concise sentence describing the grant's likely purpose.
+    Phrase the purpose as a general activity. For example, instead of 'To help the museum', write 'To support arts and cultural programs'.
+    If the recipient's name gives no specific clue, a good default is 'For general charitable purposes'.
+
+    Output only the single sentence of the generated purpose.
+    """
+
+def build_batch_prompt(tasks):
+    """
+    One prompt for several recipients of the same foundation: the foundation's name,
+    mission and the instructions are sent once, and each recipient is numbered.
+    """
+    first = tasks[0]
+    recipients = "\n".join(f"    [{number}] {' '.join(task['recipient_name'].split())}"
+                           for number, task in enumerate(tasks, 1))
+    return f"""
+    A foundation named "{first['foundation_name']}" has a mission: "{first['mission_statement']}"
+    This foundation gave grants to each of the following numbered organizations:
+{recipients}
+
+    Based only on this context, write a single, concise sentence describing each grant's likely purpose.
+    Phrase each purpose as a general activity. For example, instead of 'To help the museum', write 'To support arts and cultural programs'.
+    If an organization's name gives no specific clue, a good default is 'For general charitable purposes'.
+
+    Respond with a JSON array holding one object per organization: {{"id": <its number>, "purpose": "<the sentence>"}}.
+    """
+
+def parse_batch_response(text, count):
+    """
+    Validates a batch answer item by item. Returns {number: purpose} for the well-formed
+    items only; anything missing, duplicated, out of range or not a one-line sentence is
+    left out, so the caller can re-ask for just those pairs.
+    """
+    text = text.strip()
+    if text.startswith("```"): # a fenced block despite the JSON response type
+        text = text.strip('`').removeprefix('json').strip()
+    try:
+        items = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    numbered = [(item.get('id'), item.get('purpose')) for item in items if isinstance(item, dict)]
+    numbered = [(number, purpose) for number, purpose in numbered
+                if isinstance(number, int) and not isinstance(number, bool) and 1 <= number <= count]
+    seen = Counter(number for number, _ in numbered)
+
+    purposes = {}
+    for number, purpose in numbered:
+        if seen[number] > 1 or not isinstance(purpose, str): # two answers for one pair: trust neither
+            continue
+        purpose = clean_purpose(purpose)
+        if purpose and len(purpose) <= MAX_PURPOSE_LENGTH and '\n' not in purpose:
+            purposes[number] = purpose
+    return purposes
+
+def group_tasks(tasks, pairs_per_request=PAIRS_PER_REQUEST):
+    """Splits tasks into requests of up to `pairs_per_request` pairs that share a foundation."""
+    by_foundation = {}
+    for task in tasks:
+        by_foundation.setdefault(task['foundation_ein'], []).append(task)
+    size = max(1, pairs_per_request)
+    return [pairs[i:i + size] for pairs in by_foundation.values() for i in range(0, len(pairs), size)]
+
+def clean_purpose(text):
+    """Removes the quotes and whitespace the model tends to wrap its sentence in."""
+    return text.strip().strip('"').strip() or None
+
+class GenerationError(Exception):
+    """A failed generateContent call. `status` is None for network errors and timeouts."""
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status is None or self.status in RETRYABLE_STATUSES
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average, in bursts of up to `capacity`.
+    pause() holds every caller back, for when the server says it's over quota.
+    """
+    def __init__(self, rate, capacity=RATE_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock: # waiters are served in arrival order
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def _retry_after(headers):
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+class GeminiClient:
+    """Calls Gemini's generateContent REST endpoint over a shared aiohttp session."""
+    def __init__(self, session, api_key, model=GEMINI_MODEL, base_url=GEMINI_API_BASE):
+        self.session = session
+        self.api_key = api_key
+        self.url = f"{base_url.rstrip('/')}/v1beta/models/{model}:generateContent"
+
+    async def generate(self, prompt, generation_config=None):
+        body = {'contents': [{'parts': [{'text': prompt}]}]}
+        if generation_config:
+            body['generationConfig'] = generation_config
+        try:
+            async with self.session.post(self.url, json=body, headers={'x-goog-api-key': self.api_key}) as response:
+                if response.status != 200:
+                    detail = (await response.text())[:200]
+                    raise GenerationError(f"HTTP {response.status}: {detail}", response.status, _retry_after(response.headers))
+                payload = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise GenerationError(f"{type(e).__name__}: {e}") from e
+        try:
+            return payload['candidates'][0]['content']['parts'][0]['text']
+        except (KeyError, IndexError, TypeError):
+            # Blocked or empty: asking again gets the same answer, so this isn't retried
+            reason = (payload.get('promptFeedback') or {}).get('blockReason') or 'no candidates'
+            raise GenerationError(f"No text in response ({reason})", status=200)
+
+async def generate_with_retry(client, bucket, prompt, stats, generation_config=None):
+    """One prompt through the rate limiter, retrying 429/5xx and network errors with exponential backoff."""
+    for attempt in range(MAX_ATTEMPTS):
+        await bucket.acquire()
+        stats['requests'] += 1
+        try:
+            return await client.generate(prompt, generation_config)
+        except GenerationError as e:
+            if not e.retryable or attempt == MAX_ATTEMPTS - 1:
+                raise
+            delay = e.retry_after or random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            if e.status == 429:
+                bucket.pause(delay) # over quota: everyone waits, not just this request
+            stats['retries'] += 1
+            await asyncio.sleep(delay)
+
+async def _write_stream(queue, write_results, stats, batch_size=WRITE_BATCH_SIZE, interval=WRITE_INTERVAL):
+    """Drains generated purposes from `queue` and writes them in batches, off the event loop."""
+    done = False
+    while not done:
+        batch = []
+        deadline = time.monotonic() + interval
+        while len(batch) < batch_size:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+        if batch:
+            stats['grants_updated'] += await asyncio.to_thread(write_results, batch)
+
+async def generate_purposes(tasks, api_key, write_results, concurrency=MAX_CONCURRENT_REQUESTS,
+                            requests_per_minute=REQUESTS_PER_MINUTE, base_url=GEMINI_API_BASE, model=GEMINI_MODEL,
+                            pairs_per_request=PAIRS_PER_REQUEST):
+    """
+    Generates a purpose for every foundation/recipient task with at most `concurrency` requests
+    in flight and no more than `requests_per_minute` sent. Pairs of the same foundation are
+    asked about `pairs_per_request` at a time; pairs missing or malformed in a batch answer
+    are re-asked one by one, while a batch request that fails outright fails all its pairs. Each generated (foundation_ein, recipient_ein_matched, purpose) is
+    streamed to `write_results`, a blocking callable run in a worker thread that returns the
+    number of grants it updated.
+    Returns a Counter of generated / failed / skipped / fallbacks / requests / retries / grants_updated.
+    """
+    stats = Counter()
+    errors = Counter()
+    bucket = TokenBucket(requests_per_minute / 60.0)
+    window = asyncio.Semaphore(concurrency)
+    results = asyncio.Queue()
+    writer = asyncio.create_task(_write_stream(results, write_results, stats))
+
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        client = GeminiClient(session, api_key, model=model, base_url=base_url)
+        progress = tqdm(total=len(tasks), desc="Generating Purposes")
+
+        async def save(task, purpose):
+            stats['generated'] += 1
+            progress.update(1)
+            await results.put((task['foundation_ein'], task['recipient_ein_matched'], purpose))
+
+        def fail(task, cause, error):
+            stats['failed'] += 1
+            errors[cause] += 1
+            progress.update(1)
+            if stats['failed'] <= 5:
+                tqdm.write(f"  Failed for {task['foundation_ein']}/{task['recipient_ein_matched']}: {error}")
+
+        async def generate_single(task):
+            try:
+                purpose = clean_purpose(await generate_with_retry(client, bucket, build_purpose_prompt(task), stats))
+            except GenerationError as e:
+                fail(task, f"HTTP {e.status}" if e.status else str(e).split(':')[0], e)
+                return
+            if purpose:
+                await save(task, purpose)
+            else:
+                fail(task, 'empty response', 'empty response')
+
+        async def generate_batch(batch):
+            try:
+                text = await generate_with_retry(client, bucket, build_batch_prompt(batch), stats, BATCH_GENERATION_CONFIG)
+            except GenerationError as e:
+                # No answer at all (retries spent, or a 4xx): asking each pair alone would only
+                # multiply requests against a failing or over-quota API, so the whole batch fails
+                # and its pairs, still without a purpose, are picked up by the next run.
+                cause = f"batch HTTP {e.status}" if e.status else "batch " + str(e).split(':')[0]
+                for task in batch:
+                    fail(task, cause, e)
+                return
+            purposes = parse_batch_response(text, len(batch))
+            for number, task in enumerate(batch, 1):
+                if number in purposes:
+                    await save(task, purposes[number])
+                else:
+                    # Re-asked alone, inside this request's window slot
+                    stats['fallbacks'] += 1
+                    await generate_single(task)
+
+        async def run_request(batch):
+            if len(batch) == 1:
+                await generate_single(batch[0])
+            else:
+                await generate_batch(batch)
+
+        askable = []
+        for task in tasks:
+            if build_purpose_prompt(task):
+                askable.append(task)
+            else:
+                stats['skipped'] += 1
+                progress.update(1)
+
+        in_flight = set()
+        for batch in group_tasks(askable, pairs_per_request):
+            await window.acquire() # bounds the tasks in memory as well as the requests in flight
+            if writer.done():
+                writer.result() # a failed write stops the run instead of generating purposes nobody saves
+            request = asyncio.create_task(run_request(batch))
+            in_flight.add(request)
+            request.add_done_callback(in_flight.discard)
+            request.add_done_callback(lambda _: window.release())
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        progress.close()
+
+    await results.put(None)
+    await writer
+    if errors:
+        print("Errors by cause: " + ", ".join(f"{cause}: {count}" for cause, count in errors.most_common()))
+    return stats
+
+def ensure_purpose_cache_schema(cursor):
+    # No foreign keys, so re-ingesting (TRUNCATE grants / foundations CASCADE) leaves it intact
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS purpose_cache (
+            cache_key TEXT PRIMARY KEY,
+            prompt_version TEXT NOT NULL,
+            model_name TEXT NOT NULL,
+            foundation_ein TEXT NOT NULL,
+            recipient_ein TEXT NOT NULL,
+            purpose TEXT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS purpose_cache_pair_idx ON purpose_cache (foundation_ein, recipient_ein);")
+
+def purpose_cache_key(foundation_ein, recipient_ein, model=GEMINI_MODEL, prompt_version=PROMPT_TEMPLATE_VERSION):
+    """Everything that determines a generated purpose: the prompt template, the model and the pair."""
+    return hashlib.sha256(f"{prompt_version}|{model}|{foundation_ein}|{recipient_ein}".encode('utf-8')).hexdigest()
+
+def fill_purposes_from_cache(conn, model=GEMINI_MODEL, prompt_version=PROMPT_TEMPLATE_VERSION):
+    """
+    Restores cached purposes onto every still-empty grant of a cached pair with one
+    UPDATE ... FROM, without any API calls, and commits. Returns the number of grants filled.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE grants g SET grant_purpose = pc.purpose
+            FROM purpose_cache pc
+            WHERE pc.prompt_version = %s AND pc.model_name = %s
+              AND g.foundation_ein = pc.foundation_ein
+              AND g.recipient_ein_matched = pc.recipient_ein
+              AND g.grant_purpose IS NULL
+        """, (prompt_version, model))
+        filled = cursor.rowcount
+    conn.commit()
+    return filled
+
+def purge_stale_purposes(conn, model=GEMINI_MODEL, prompt_version=PROMPT_TEMPLATE_VERSION):
+    """Deletes cached purposes from other prompt versions or models. Returns the number deleted."""
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM purpose_cache WHERE prompt_version <> %s OR model_name <> %s", (prompt_version, model))
+        deleted = cursor.rowcount
+    conn.commit()
+    return deleted
+
+def write_purposes(conn, purposes, model=GEMINI_MODEL, prompt_version=PROMPT_TEMPLATE_VERSION):
+    """
+    Records each generated (foundation_ein, recipient_ein_matched, purpose) in purpose_cache
+    and sets grant_purpose on every still-empty grant of the pair through a COPY-loaded
+    staging table, in one transaction. Returns the number of grants updated.
+    """
+    with conn.cursor() as cursor:
+        bulk_insert(cursor, 'purpose_cache',
+                    ['cache_key', 'prompt_version', 'model_name', 'foundation_ein', 'recipient_ein', 'purpose'],
+                    ((purpose_cache_key(foundation_ein, recipient_ein, model, prompt_version), prompt_version, model,
+                      foundation_ein, recipient_ein, purpose) for foundation_ein, recipient_ein, purpose in purposes),
+                    on_conflict="ON CONFLICT (cache_key) DO UPDATE SET purpose = EXCLUDED.purpose", report=False)
+        staging, _ = copy_into_staging(cursor, 'grants', ['foundation_ein', 'recipient_ein_matched', 'grant_purpose'], purposes)
+        cursor.execute(sql.SQL("""
+            UPDATE grants g SET grant_purpose = s.grant_purpose
+            FROM {} s
+            WHERE g.foundation_ein = s.foundation_ein
+              AND g.recipient_ein_matched = s.recipient_ein_matched
+              AND g.grant_purpose IS NULL
+        """).format(sql.Identifier(staging)))
+        updated = cursor.rowcount
+    conn.commit()
+    return updated
+
+def generate_missing_purposes(conn, api_key, model=GEMINI_MODEL, purge_stale=False, **kwargs):
+    """
+    Fills in grant purposes: first from purpose_cache (so a re-ingest costs no API calls),
+    then by generating the pairs still missing one. Generated purposes are cached and
+    committed as they arrive, so an interrupted run keeps its progress.
+    Returns generate_purposes()' stats plus 'from_cache' (grants filled from the cache).
+    """
+    with conn.cursor() as cursor:
+        ensure_purpose_cache_schema(cursor)
+    conn.commit()
+    if purge_stale:
+        print(f"Purged {purge_stale_purposes(conn, model):,} cached purposes from other prompt versions or models.")
+
+    from_cache = fill_purposes_from_cache(conn, model)
+    if from_cache:
+        print(f"Restored purposes for {from_cache:,} grants from the purpose cache.")
+
+    with conn.cursor() as cursor:
+        cursor.execute(MISSING_PURPOSE_QUERY)
+        rows = cursor.fetchall()
+    # One request per pair, even when a recipient EIN has several charity names
+    tasks = list({(row['foundation_ein'], row['recipient_ein_matched']): row for row in rows}.values())
+    stats = Counter()
+    if tasks:
+        print(f"Found {len(tasks)} unique foundation/recipient pairs to process with AI.")
+        stats = asyncio.run(generate_purposes(tasks, api_key, lambda purposes: write_purposes(conn, purposes, model),
+                                              model=model, **kwargs))
+    stats['from_cache'] = from_cache
+    return stats
@@ -4,35 +4,22 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-import re
 import psycopg2
 from psycopg2.extras import RealDictCursor, execute_batch
 from fuzzywuzzy import process
 from tqdm import tqdm
 from multiprocessing import Pool, Manager, cpu_count
 
+from name_normalizer import normalize_name
+
 # --- CONFIGURATION ---
 NUM_PROCESSES = max(1, cpu_count() - 1)
+NORMALIZER_VERSION = 'v1-ext' # this test strips the broader suffix list
 
 # --- GLOBAL VARIABLES FOR WORKERS ---
 normalized_ein_map_global = None
 normalized_choices_global = None
 
-def normalize_name(name):
-    if not name: return ""
-    name = name.upper().replace('&', 'AND')
-    name = re.sub(r'[^\w\s]', '', name)
-    suffixes_to_remove = [
-        'INC', 'INCORPORATED', 'LLC', 'L L C', 'CORP', 'CORPORATION',
-        'FOUNDATION', 'FDN', 'FUND', 'TRUST', 'CHARITABLE', 'CHARITY',
-        'ASSOCIATION', 'SOCIETY', 'LEAGUE', 'CLUB', 'CENTER',
-        'UNIVERSITY', 'UNIV', 'COLLEGE', 'SCHOOL', 'HOSPITAL',
-        'THE', 'AND', 'OF', 'FOR', 'PROGRAM', 'DEPARTMENT'
-    ]
-    for suffix in suffixes_to_remove:
-        name = re.sub(r'\b' + re.escape(suffix) + r'\b', '', name)
-    return re.sub(r'\s+', ' ', name).strip()
-
 def init_worker(ein_map, choices):
     """Initializes the global variables for each worker process."""
     global normalized_ein_map_global, normalized_choices_global
@@ -42,7 +29,7 @@ def init_worker(ein_map, choices):
 def match_grant_recipient(grant):
     """The core logic that each worker will run on a single grant."""
     grant_id = grant['id']
-    normalized_recipient = normalize_name(grant['recipient_name'])
+    normalized_recipient = normalize_name(grant['recipient_name'], NORMALIZER_VERSION)
     if not normalized_recipient:
         return None
 
@@ -72,7 +59,7 @@ def main():
         with conn.cursor() as cursor:
             cursor.execute("SELECT ein, name FROM foundations WHERE name IS NOT NULL")
             for row in cursor.fetchall():
-                normalized = normalize_name(row['name'])
+                normalized = normalize_name(row['name'], NORMALIZER_VERSION)
                 if normalized and normalized not in temp_map:
                     temp_map[normalized] = row['ein']
         
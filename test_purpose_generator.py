@@ -0,0 +1,75 @@
+# test_purpose_generator.py (Purpose Generation against the Local Fake Gemini Server)
+
+import socket
+import asyncio
+import aiohttp
+
+import purpose_generator
+from purpose_generator import generate_purposes
+from fake_llm_server import FakeGemini, start_fake_server
+
+# --- CONFIGURATION ---
+FOUNDATIONS = 6
+PAIRS_PER_FOUNDATION = 25 # more than one batch per foundation at 20 pairs per request
+THROTTLE_RATE = 0.1 # share of requests answered 429
+ERROR_RATE = 0.1 # share of requests answered 503
+MALFORMED_RATE = 0.2 # share of batch items dropped or garbled
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _tasks():
+    return [{'foundation_ein': f"F{f}", 'foundation_name': f"Foundation {f}", 'mission_statement': "Helping people",
+             'recipient_name': f"recipient {f} {r}", 'recipient_ein_matched': f"R{f}-{r}"}
+            for f in range(FOUNDATIONS) for r in range(PAIRS_PER_FOUNDATION)]
+
+async def _run(tasks):
+    fake = FakeGemini(latency=0.01, throttle_rate=THROTTLE_RATE, error_rate=ERROR_RATE, malformed_rate=MALFORMED_RATE)
+    port = _free_port()
+    runner = await start_fake_server(fake, port=port)
+    written = []
+    def write_results(batch):
+        written.extend(batch)
+        return len(batch)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        stats = await generate_purposes(tasks, "test-key", write_results, concurrency=8,
+                                        requests_per_minute=60000, base_url=base_url)
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{base_url}/stats") as response:
+                served = await response.json()
+    finally:
+        await runner.cleanup()
+    return stats, served, written
+
+def test_generate_purposes_with_fake_server():
+    """Retries, batch-item fallbacks and streamed writes, checked against what the fake served."""
+    tasks = _tasks()
+    backoff = purpose_generator.BACKOFF_BASE, purpose_generator.BACKOFF_MAX
+    purpose_generator.BACKOFF_BASE, purpose_generator.BACKOFF_MAX = 0.01, 0.05 # keep 503 backoff short
+    try:
+        stats, served, written = asyncio.run(_run(tasks))
+    finally:
+        purpose_generator.BACKOFF_BASE, purpose_generator.BACKOFF_MAX = backoff
+
+    # Every pair ends up generated or failed, and everything generated was written
+    assert stats['generated'] + stats['failed'] == len(tasks)
+    assert stats['generated'] == len(written) == stats['grants_updated']
+    expected = {(task['foundation_ein'], task['recipient_ein_matched']):
+                f"To support the programs of {task['recipient_name'].title()}." for task in tasks}
+    for foundation_ein, recipient_ein, purpose in written:
+        assert purpose == expected[(foundation_ein, recipient_ein)]
+
+    # The client's counts agree with what the server saw
+    assert served['requests'] == stats['requests']
+    assert served['429'] > 0 and served['503'] > 0 and served['malformed_items'] > 0
+    assert stats['retries'] <= served['429'] + served['503']
+    # Only items missing from a batch answer are re-asked one by one
+    assert stats['fallbacks'] == served['malformed_items']
+    assert served['batch_requests'] <= FOUNDATIONS * 2
+
+if __name__ == "__main__":
+    test_generate_purposes_with_fake_server()
+    print("Purpose generation against the fake server: OK")